@@ -1,8 +1,24 @@
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import urllib3
-from config import GIGACHAT_AUTH_KEY
+from config import (
+    GIGACHAT_AUTH_KEY,
+    GIGACHAT_POOL_SIZE,
+    GIGACHAT_TIMEOUT,
+    GIGACHAT_TOKEN_REFRESH_MARGIN,
+    GIGACHAT_HEDGE_PERCENTILE,
+    GIGACHAT_HEDGE_MIN_SAMPLES,
+    DEADLINE_BUDGETS,
+)
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
+from metrics import STAGE_SECONDS, counter, histogram, stage_timer
+from resilience import CircuitBreaker, call_hedged, parse_budgets
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -14,12 +30,100 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+GIGACHAT_ERROR_MESSAGE = "Произошла ошибка при обращении к GigaChat."
 
-def ask_gigachat(
+
+class GigaChatUnavailable(Exception):
+    """GigaChat не ответил в отведённое время, вернул ошибку или отключён
+    предохранителем; вызывающий код отвечает без него."""
+
+
+class PoolBusy(TimeoutError):
+    """Все клиенты пула заняты: запрос до GigaChat не дошёл, и
+    предохранитель такую ошибку не учитывает."""
+
+
+class GigaChatPool:
+    """Пул долгоживущих клиентов GigaChat.
+
+    Клиенты переиспользуют HTTP-соединения и токен доступа; токен
+    обновляется заранее, за refresh_margin секунд до истечения. Таймаут
+    SDK не больше бюджета этапа llm: брошенный по дедлайну запрос не
+    должен занимать клиента дольше, чем его ждёт сообщение.
+    """
+
+    def __init__(
+        self,
+        size=GIGACHAT_POOL_SIZE,
+        timeout=GIGACHAT_TIMEOUT,
+        refresh_margin=GIGACHAT_TOKEN_REFRESH_MARGIN,
+    ):
+        self.timeout = min(timeout, parse_budgets(DEADLINE_BUDGETS).get("llm", timeout))
+        self.refresh_margin = refresh_margin
+        self._clients = queue.Queue()
+        self._expires_at = {}
+        for _ in range(max(1, size)):
+            self._clients.put(self._create_client())
+
+    def _create_client(self):
+        return GigaChat(
+            credentials=GIGACHAT_AUTH_KEY,
+            verify_ssl_certs=False,
+            timeout=self.timeout,
+        )
+
+    def _ensure_token(self, client):
+        expires_at = self._expires_at.get(id(client), 0)
+        if time.time() < expires_at - self.refresh_margin:
+            return
+        start = time.time()
+        with stage_timer("gigachat_token"):
+            token = client.get_token()
+        # expires_at приходит в миллисекундах
+        self._expires_at[id(client)] = (
+            token.expires_at / 1000 if token else time.time() + self.refresh_margin
+        )
+        logger.info(f"Токен GigaChat обновлён за {time.time() - start:.2f} секунд.")
+
+    @contextmanager
+    def client(self, timeout=None):
+        try:
+            client = self._clients.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolBusy("нет свободного клиента GigaChat")
+        try:
+            self._ensure_token(client)
+            yield client
+        finally:
+            self._clients.put(client)
+
+    def close(self):
+        while not self._clients.empty():
+            self._clients.get_nowait().close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+breaker = CircuitBreaker("gigachat")
+# запас потоков на повторные запросы и на зависшие вызовы, которые уже не ждут
+_executor = ThreadPoolExecutor(
+    max_workers=GIGACHAT_POOL_SIZE * 2, thread_name_prefix="gigachat"
+)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = GigaChatPool()
+    return _pool
+
+
+def build_messages(
     user_question, context_text, external=False, is_binary=False, is_list=False
 ):
-    client = GigaChat(credentials=GIGACHAT_AUTH_KEY, verify_ssl_certs=False)
-
     if external:
         system_prompt = (
             "Ты — бот-консультант по образовательным проектам VK Education. "
@@ -46,19 +150,186 @@ def ask_gigachat(
             content=f"Контекст:\n{context_text}\n\nВопрос: {user_question}",
         ),
     ]
+    return messages
+
+
+def hedge_delay():
+    """Через сколько секунд без ответа отправлять повторный запрос."""
+    if not GIGACHAT_HEDGE_PERCENTILE:
+        return None
+    latency = histogram(STAGE_SECONDS, stage="gigachat_request")
+    if latency.count < GIGACHAT_HEDGE_MIN_SAMPLES:
+        return None
+    points = latency.percentiles((GIGACHAT_HEDGE_PERCENTILE,))
+    return points.get(f"p{GIGACHAT_HEDGE_PERCENTILE}")
+
+
+def _chat(messages, timeout, sent, abandoned):
+    with get_pool().client(timeout=timeout) as client:
+        return _send(client, messages, sent, abandoned)
+
+
+def _chat_hedge(messages, sent, abandoned):
+    # повторный запрос имеет смысл только при свободном клиенте: иначе он
+    # встаёт в очередь и лишь добавляет нагрузки деградирующему сервису
+    with get_pool().client(timeout=0) as client:
+        return _send(client, messages, sent, abandoned)
+
+
+def _send(client, messages, sent, abandoned):
+    # клиент мог освободиться, когда ответ уже получен или ждать перестали
+    if abandoned.is_set():
+        raise TimeoutError("ответ уже не ждут")
+    sent.set()
+    start = time.time()
+    with stage_timer("gigachat_request"):
+        response = client.chat(Chat(messages=messages))
+    logger.debug(f"Запрос chat выполнен за {time.time() - start:.2f} секунд.")
+    return response.choices[0].message.content
+
+
+def gigachat_token_counts(texts, timeout=GIGACHAT_TIMEOUT):
+    """Число токенов каждого текста по токенизатору GigaChat (tokens_count)."""
+    with get_pool().client(timeout=timeout) as client:
+        return [item.tokens for item in client.tokens_count(list(texts))]
+
+
+def _failed(reason, error):
+    counter(
+        "vkbot_gigachat_errors_total", "Ошибки запросов к GigaChat", reason=reason
+    ).inc()
+    return GigaChatUnavailable(error)
+
+
+def ask_gigachat(
+    user_question,
+    context_text,
+    external=False,
+    is_binary=False,
+    is_list=False,
+    timeout=None,
+):
+    """Возвращает ответ GigaChat не позже чем через timeout секунд.
+
+    Если ответ задерживается дольше обычного (перцентиль
+    GIGACHAT_HEDGE_PERCENTILE), параллельно уходит повторный запрос.
+    При ошибке, таймауте или разомкнутом предохранителе —
+    GigaChatUnavailable.
+    """
+    messages = build_messages(user_question, context_text, external, is_binary, is_list)
 
     logger.debug("Отправка запроса к GigaChat")
     logger.debug(f"Вопрос: {user_question}")
     logger.debug(f"Контекст (обрезан): {context_text[:400]}...")
 
+    timeout = GIGACHAT_TIMEOUT if timeout is None else timeout
+    if timeout <= 0:
+        raise _failed("deadline", "не осталось времени на запрос")
+    if not breaker.allow():
+        raise _failed("circuit_open", "предохранитель GigaChat разомкнут")
+
+    # установлен, если хотя бы одна копия получила клиента и отправила запрос
+    sent = threading.Event()
+    # установлен, когда результат больше не нужен: получен или вышло время
+    abandoned = threading.Event()
     try:
-        response = client.chat(Chat(messages=messages))
-        content = response.choices[0].message.content
+        content = call_hedged(
+            _executor,
+            lambda: _chat(messages, timeout, sent, abandoned),
+            timeout=timeout,
+            hedge_after=hedge_delay(),
+            hedge_func=lambda: _chat_hedge(messages, sent, abandoned),
+        )
+    except TimeoutError as e:
+        if not sent.is_set():
+            # очередь за клиентом — наша перегрузка, а не отказ GigaChat
+            logger.error(f"Нет свободного клиента GigaChat за {timeout:.2f} секунд.")
+            raise _failed("pool", e) from e
+        logger.error(f"GigaChat не ответил за {timeout:.2f} секунд.")
+        breaker.record_failure()
+        raise _failed("timeout", e) from e
+    except Exception as e:
+        logger.error(f"Ошибка при обращении к GigaChat SDK: {e}")
+        breaker.record_failure()
+        raise _failed("error", e) from e
+    finally:
+        abandoned.set()
+    breaker.record_success()
+
+    logger.debug("Ответ от GigaChat:")
+    logger.debug(f"{content[:500]}{'...' if len(content) > 500 else ''}")
+    return content
 
-        logger.debug("Ответ от GigaChat:")
-        logger.debug(f"{content[:500]}{'...' if len(content) > 500 else ''}")
 
-        return content
+_STREAM_END = object()
+
+
+def _pump_stream(messages, timeout, chunks, sent, abandoned):
+    """Читает поток SDK в потоке _executor и складывает фрагменты в chunks.
+
+    Клиент возвращается в пул, только когда чтение действительно
+    закончилось: брошенный читателем поток не отдаёт занятого клиента
+    другому запросу.
+    """
+    try:
+        with get_pool().client(timeout=timeout) as client:
+            sent.set()
+            for chunk in client.stream(Chat(messages=messages)):
+                if abandoned.is_set():
+                    return
+                chunks.put(chunk.choices[0].delta.content)
+        chunks.put(_STREAM_END)
     except Exception as e:
-        logger.error(f"Ошибка при обращении к GigaChat SDK: {e}")
-        return "Произошла ошибка при обращении к GigaChat."
+        chunks.put(e)
+
+
+def ask_gigachat_stream(
+    user_question,
+    context_text,
+    external=False,
+    is_binary=False,
+    is_list=False,
+    timeout=None,
+):
+    """Потоковый вариант ask_gigachat: отдаёт фрагменты ответа по мере генерации.
+
+    Ошибки не перехватываются — вызывающий код сам решает, как откатиться
+    на обычный запрос, — но учитываются предохранителем. Весь ответ,
+    включая ожидание свободного клиента, должен уложиться в timeout:
+    если очередной фрагмент не пришёл вовремя — TimeoutError, если не
+    нашлось клиента — GigaChatUnavailable.
+    """
+    messages = build_messages(user_question, context_text, external, is_binary, is_list)
+    logger.debug(f"Потоковый запрос к GigaChat: {user_question}")
+
+    if not breaker.allow():
+        raise _failed("circuit_open", "предохранитель GigaChat разомкнут")
+    timeout = GIGACHAT_TIMEOUT if timeout is None else timeout
+    expires_at = time.monotonic() + timeout
+    chunks = queue.Queue()
+    sent = threading.Event()
+    abandoned = threading.Event()
+    pump = _executor.submit(_pump_stream, messages, timeout, chunks, sent, abandoned)
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=max(0.0, expires_at - time.monotonic()))
+            except queue.Empty:
+                if not sent.is_set():
+                    raise _failed("pool", "нет свободного клиента GigaChat")
+                breaker.record_failure()
+                raise TimeoutError(f"поток GigaChat не уложился в {timeout:.2f} с")
+            if item is _STREAM_END:
+                break
+            if isinstance(item, PoolBusy):
+                raise _failed("pool", item) from item
+            if isinstance(item, Exception):
+                breaker.record_failure()
+                raise item
+            if item:
+                yield item
+    finally:
+        # читатель ушёл (готово, ошибка или дедлайн): поток SDK больше не нужен
+        abandoned.set()
+        pump.cancel()
+    breaker.record_success()
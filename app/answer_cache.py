@@ -0,0 +1,124 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY, ANSWER_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text):
+    text = re.sub(r"[^\w\s]", " ", text.lower().replace("ё", "е"))
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    """LRU-кэш ответов GigaChat с TTL.
+
+    Первый уровень — точное совпадение нормализованного вопроса, второй —
+    близкий по эмбеддингу вопрос с теми же флагами (external, is_binary,
+    is_list).
+
+    generation растёт при каждом clear(). Вызывающий запоминает её до
+    поиска по базе знаний и передаёт в put(): ответ, собранный по старой
+    базе, после очистки в кэш уже не попадёт.
+    """
+
+    def __init__(
+        self,
+        max_size=ANSWER_CACHE_SIZE,
+        ttl=ANSWER_CACHE_TTL,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding):
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        length = np.linalg.norm(vector)
+        return vector / length if length else None
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl
+
+    def get(self, question, flags, embedding=None):
+        key = (normalize_question(question), tuple(flags))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, _, created = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return answer
+                del self._entries[key]
+
+            query = self._unit(embedding)
+            if query is not None:
+                best_key, best_score = None, self.similarity_threshold
+                for other_key, (_, vector, created) in list(self._entries.items()):
+                    if other_key[1] != key[1] or vector is None:
+                        continue
+                    if self._expired(created):
+                        del self._entries[other_key]
+                        continue
+                    score = float(vector @ query)
+                    if score >= best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    logger.debug(
+                        f"Ответ из кэша по похожему вопросу: {best_key[0]} ({best_score:.2f})"
+                    )
+                    return self._entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, question, flags, answer, embedding=None, generation=None):
+        key = (normalize_question(question), tuple(flags))
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                logger.debug(
+                    f"Ответ на «{key[0]}» получен до очистки кэша, не кэшируем"
+                )
+                return
+            self._entries[key] = (answer, self._unit(embedding), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+        logger.info("Кэш ответов очищен.")
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "size": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / total if total else 0.0,
+            }
+
+
+answer_cache = AnswerCache()
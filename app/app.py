@@ -1,56 +1,330 @@
 import logging
+import threading
 import time
-from config import VK_API_TOKEN, VK_GROUP_ID
+from config import (
+    VK_API_TOKEN,
+    VK_GROUP_ID,
+    WORKER_COUNT,
+    WORKER_QUEUE_SIZE,
+    METRICS_PORT,
+    METRICS_LOG_INTERVAL,
+    GIGACHAT_STREAMING,
+    STREAM_EDIT_INTERVAL,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOKEN_CALIBRATION_SAMPLES,
+    DIRECT_ANSWER_THRESHOLD,
+    FAQ_PATH,
+    VK_RATE_LIMIT,
+    HANDLER_PROCESSES,
+)
 import vk_api
 from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
-from text_utils import correct_spelling
-from ai_gigachat import ask_gigachat
+from text_utils import (
+    correct_spelling,
+    set_protected_vocabulary,
+    spelling_cache_stats,
+)
+from ai_gigachat import (
+    ask_gigachat,
+    ask_gigachat_stream,
+    breaker as gigachat_breaker,
+    gigachat_token_counts,
+    GigaChatUnavailable,
+    GIGACHAT_ERROR_MESSAGE,
+)
+from answer_cache import answer_cache, normalize_question
 from db import get_intro_text
 from text_utils import contains_profanity
+from dispatcher import MessageDispatcher
+from outbound import OutboundSender
+from singleflight import SingleFlight, UserRateLimiter
+from resilience import Deadline
+from context_builder import calibrate_token_count, count_tokens
+from models import warm_up, startup_report
+from metrics import (
+    STAGE_SECONDS,
+    counter,
+    gauge,
+    histogram,
+    stage_timer,
+    timed,
+    start_metrics_server,
+    start_summary_logger,
+)
 
 from db import (
     init_db,
-    update_if_needed,
+    knowledge_index,
+    start_background_refresh,
+    start_store_watcher,
+    KnowledgeQuery,
+    on_knowledge_updated,
     search_knowledge,
+    find_faq_answer,
+    import_faq,
     get_top_context,
     is_vke_related,
     is_list_request,
     generate_help_link,
     list_projects_for_audience,
+    rows_at,
 )
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# меньше этого на GigaChat не осталось — сразу отвечаем по базе знаний
+MIN_LLM_BUDGET = 1.0
+
+REPEATED_QUESTION_MESSAGE = "Этот вопрос вы уже задавали — ответ есть выше в диалоге."
+
+
+def refresh_protected_vocabulary():
+    rows = knowledge_index.snapshot().rows
+    set_protected_vocabulary(
+        text for title, content, _ in rows for text in (title, content)
+    )
+
+
+def calibrate_context_tokens():
+    """Сверяет оценку токенов контекста с GigaChat на фрагментах базы.
+
+    Выполняется в фоне: запуск и обновление базы не ждут GigaChat.
+    """
+    if not CONTEXT_TOKEN_CALIBRATION_SAMPLES:
+        return
+    rows = knowledge_index.snapshot().rows
+    step = max(1, len(rows) // CONTEXT_TOKEN_CALIBRATION_SAMPLES)
+    positions = list(range(0, len(rows), step))[:CONTEXT_TOKEN_CALIBRATION_SAMPLES]
+    samples = [content for _, content, _ in rows_at(rows, positions)]
+
+    def run():
+        try:
+            calibrate_token_count(samples, gigachat_token_counts)
+        except Exception as e:
+            logger.warning(f"Не удалось откалибровать подсчёт токенов: {e}")
+
+    threading.Thread(target=run, name="token-calibration", daemon=True).start()
+
 
 class VkBot:
-    def __init__(self):
+    def __init__(
+        self,
+        use_longpoll=True,
+        primary=True,
+        metrics_port=METRICS_PORT,
+        vk_rate=VK_RATE_LIMIT,
+    ):
+        """primary=False — процесс-обработчик multiprocess.py: базу знаний
+        обновляет главный процесс, здесь индекс только перечитывается."""
         logger.info("Запуск бота...")
         start_time = time.time()
+        warm_up_executor = warm_up()
 
         self.vk_session = vk_api.VkApi(token=VK_API_TOKEN)
-        self.longpoll = VkBotLongPoll(self.vk_session, group_id=VK_GROUP_ID)
+        self.longpoll = (
+            VkBotLongPoll(self.vk_session, group_id=VK_GROUP_ID)
+            if use_longpoll
+            else None
+        )
         self.vk = self.vk_session.get_api()
+        self.sender = OutboundSender(self.vk_session, rate=vk_rate)
+        self.dispatcher = MessageDispatcher(
+            self.handle_message, workers=WORKER_COUNT, queue_size=WORKER_QUEUE_SIZE
+        )
 
-        logger.info("Инициализация VK API завершена.")
+        self.single_flight = SingleFlight()
+        self.rate_limiter = UserRateLimiter()
 
+        self._register_metrics(metrics_port)
+
+        vk_duration = time.time() - start_time
+        logger.info(f"Инициализация VK API завершена за {vk_duration:.2f} секунд.")
+
+        db_start_time = time.time()
+        on_knowledge_updated(answer_cache.clear)
+        on_knowledge_updated(refresh_protected_vocabulary)
+        on_knowledge_updated(calibrate_context_tokens)
         init_db()
-        update_if_needed()
+        if primary:
+            import_faq(FAQ_PATH)
+        knowledge_index.writer = primary
+        knowledge_index.load()
+        refresh_protected_vocabulary()
+        calibrate_context_tokens()
+        if primary:
+            self.refresh_stop = start_background_refresh()
+        else:
+            self.refresh_stop = start_store_watcher()
+        db_duration = time.time() - db_start_time
+        logger.info(f"База знаний загружена за {db_duration:.2f} секунд.")
+
+        warm_up_executor.shutdown(wait=True)
+        logger.info(startup_report())
 
         init_duration = time.time() - start_time
         logger.info(f"Инициализация бота завершена за {init_duration:.2f} секунд.")
 
+    def _register_metrics(self, metrics_port):
+        gauge(
+            "vkbot_queue_depth",
+            self.dispatcher.queue_depth,
+            "Сообщения, ожидающие обработки",
+        )
+        gauge(
+            "vkbot_outbound_queue_depth",
+            self.sender.queue_depth,
+            "Исходящие вызовы VK API в очереди",
+        )
+        gauge(
+            "vkbot_answer_cache_hit_ratio",
+            lambda: answer_cache.stats()["hit_ratio"],
+            "Доля ответов из кэша",
+        )
+        gauge(
+            "vkbot_spelling_cache_hit_ratio",
+            lambda: spelling_cache_stats()["hit_ratio"],
+            "Доля попаданий в кэш орфографии",
+        )
+        gauge(
+            "vkbot_coalesced_ratio",
+            lambda: self.single_flight.stats()["shared_ratio"],
+            "Доля запросов, присоединившихся к уже идущей обработке",
+        )
+        gauge(
+            "vkbot_inflight_questions",
+            lambda: self.single_flight.stats()["inflight"],
+            "Вопросы, обрабатываемые прямо сейчас",
+        )
+        gauge(
+            "vkbot_gigachat_circuit_open",
+            lambda: gigachat_breaker.is_open,
+            "Предохранитель GigaChat разомкнут",
+        )
+        if metrics_port:
+            start_metrics_server(metrics_port)
+        if METRICS_LOG_INTERVAL:
+            start_summary_logger(METRICS_LOG_INTERVAL)
+
     def send_message(self, user_id, message):
         logger.info(f"Отправка сообщения для {user_id}...")
-        self.vk.messages.send(
-            user_id=user_id,
-            message=message,
-            random_id=vk_api.utils.get_random_id(),
-        )
+        with stage_timer("send"):
+            message_id = self.sender.call(
+                "messages.send",
+                {
+                    "user_id": user_id,
+                    "message": message,
+                    "random_id": vk_api.utils.get_random_id(),
+                },
+            ).result()
         logger.info(f"Отправлено сообщение для {user_id}")
+        return message_id
+
+    def edit_message(self, user_id, message_id, message):
+        with stage_timer("edit"):
+            self.sender.call(
+                "messages.edit",
+                {"peer_id": user_id, "message_id": message_id, "message": message},
+            ).result()
+
+    def deliver(self, user_id, message, message_id=None):
+        """Отправляет ответ или, если часть уже показана, дописывает его правкой."""
+        if message_id is None:
+            self.send_message(user_id, message)
+            return
+        try:
+            self.edit_message(user_id, message_id, message)
+        except Exception as e:
+            logger.warning(f"Не удалось отредактировать сообщение {message_id}: {e}")
+            self.send_message(user_id, message)
+
+    def stream_answer(self, user_id, timeout=None, **ask_kwargs):
+        """Показывает ответ GigaChat по мере генерации.
 
-    def handle_message(self, event):
+        Первый фрагмент отправляется сразу, дальше сообщение редактируется
+        не чаще раза в STREAM_EDIT_INTERVAL секунд. При ошибке выполняется
+        обычный запрос в пределах оставшегося timeout; если timeout истёк,
+        когда часть ответа уже показана, показанная часть и остаётся.
+        Возвращает (текст ответа, id отправленного сообщения, обрезан ли
+        ответ); обрезанный ответ не кэшируется.
+        """
+        start = time.time()
+        text = ""
+        message_id = None
+        last_edit = 0.0
+        try:
+            for chunk in ask_gigachat_stream(timeout=timeout, **ask_kwargs):
+                if timeout is not None and time.time() - start > timeout:
+                    raise TimeoutError(f"поток не уложился в {timeout:.2f} с")
+                text += chunk
+                if not text.strip():
+                    continue
+                now = time.time()
+                if message_id is None:
+                    message_id = self.send_message(user_id, text)
+                    last_edit = now
+                    histogram(STAGE_SECONDS, stage="llm_first_byte").observe(
+                        now - start
+                    )
+                elif now - last_edit >= STREAM_EDIT_INTERVAL:
+                    try:
+                        self.edit_message(user_id, message_id, text)
+                    except Exception as e:
+                        logger.warning(f"Ошибка промежуточной правки: {e}")
+                    last_edit = now
+            if not text.strip():
+                raise ValueError("пустой потоковый ответ")
+            return text, message_id, False
+        except GigaChatUnavailable:
+            raise
+        except Exception as e:
+            if message_id is not None and isinstance(e, TimeoutError):
+                logger.warning(f"Потоковый ответ обрезан: {e}")
+                return text + "…", message_id, True
+            logger.warning(f"Потоковый ответ не удался, обычный запрос: {e}")
+            if timeout is not None:
+                timeout -= time.time() - start
+            return ask_gigachat(timeout=timeout, **ask_kwargs), message_id, False
+
+    def fallback_answer(self, corrected_text, query, external):
+        """Ответ без GigaChat: ближайший фрагмент базы знаний со ссылками."""
+        found = (
+            None
+            if external
+            else search_knowledge(corrected_text, query=query, default=None)
+        )
+        if found is None:
+            return GIGACHAT_ERROR_MESSAGE
+        answer = f"Сейчас не получается подготовить подробный ответ. Вот что я нашёл:\n\n{found}"
+        return self.add_help_links(answer, corrected_text, query)
+
+    def add_help_links(self, answer, corrected_text, query):
+        if any(
+            word in answer.lower()
+            for word in [
+                "проект",
+                "участие",
+                "курс",
+                "обучение",
+                "программа",
+                "vk education",
+            ]
+        ):
+            links = generate_help_link(corrected_text, top_k=3, query=query)
+            answer += f"\n\n🔗 Подробнее: \n{links}"
+        return answer
+
+    @staticmethod
+    def record_route(user_id, path):
+        counter("vkbot_route_total", "Сообщения по путям обработки", path=path).inc()
+        logger.info(f"Путь обработки для {user_id}: {path}")
+
+    @timed("handle_message")
+    def handle_message(self, event, received_at=None):
+        """received_at — момент приёма события (time.monotonic), по
+        умолчанию сейчас."""
+        counter("vkbot_messages_total", "Обработанные сообщения").inc()
         try:
             message = event.object
             user_id = message["from_id"]
@@ -58,36 +332,80 @@ class VkBot:
 
             logger.info(f"Новое сообщение от {user_id}: {text}")
 
-            if text in ["/start", "начать"]:
-                self.send_message(
-                    user_id, "Привет! Я бот VK Education. Задай мне вопрос о проектах."
-                )
+            deadline = Deadline(started=received_at)
+            histogram(STAGE_SECONDS, stage="queue").observe(
+                time.monotonic() - deadline.started
+            )
+            key = normalize_question(text)
+            rejected = self.rate_limiter.allow(user_id, key, received_at)
+            if rejected:
+                self.record_route(user_id, rejected)
+                if rejected == "repeated":
+                    self.deliver(user_id, REPEATED_QUESTION_MESSAGE, None)
                 return
 
-            if not text:
-                self.send_message(user_id, "Пожалуйста, напиши текст вопроса.")
-                return
+            delivered_route = None
+            try:
+                (route, answer, message_id), shared = self.single_flight.do(
+                    key, lambda: self.build_reply(user_id, text, deadline)
+                )
+                if shared:
+                    # частичный ответ показан только тому, кто запустил обработку
+                    route, message_id = f"{route}_shared", None
+                self.record_route(user_id, route)
+                with deadline.stage("send"):
+                    self.deliver(user_id, answer, message_id)
+                delivered_route = route
+            finally:
+                self.rate_limiter.finish(user_id, key, delivered_route)
+
+        except Exception as e:
+            logger.error(f"Ошибка обработки события: {e}")
+
+    def build_reply(self, user_id, text, deadline=None):
+        """Проходит весь конвейер и возвращает (путь, ответ, message_id).
+
+        message_id не None, если ответ уже частично показан пользователю
+        user_id потоковой отправкой. Время этапов ограничено deadline.
+        """
+        deadline = deadline or Deadline()
+        if text in ["/start", "начать"]:
+            return (
+                "start",
+                "Привет! Я бот VK Education. Задай мне вопрос о проектах.",
+                None,
+            )
 
+        if not text:
+            return "empty", "Пожалуйста, напиши текст вопроса.", None
+
+        with stage_timer("spelling"), deadline.stage("spelling"):
             corrected_text = correct_spelling(text)
-            logger.info(f"Исправленный текст: {corrected_text}")
+        logger.info(f"Исправленный текст: {corrected_text}")
 
-            if contains_profanity(corrected_text):
-                self.send_message(
-                    user_id,
-                    "⚠️ Пожалуйста, избегайте нецензурной лексики. Я помогу, если вы переформулируете вопрос корректно.",
-                )
-                return
+        with stage_timer("toxicity"), deadline.stage("toxicity"):
+            is_toxic = contains_profanity(corrected_text)
+        if is_toxic:
+            return (
+                "profanity",
+                "⚠️ Пожалуйста, избегайте нецензурной лексики. Я помогу, если вы переформулируете вопрос корректно.",
+                None,
+            )
 
-            yes_no_triggers = [
-                "возможно ли",
-                "можно ли",
-                "нельзя ли",
-                "имею ли право",
-                "допускается ли",
-            ]
-            is_binary = any(trigger in corrected_text for trigger in yes_no_triggers)
-            is_list = is_list_request(corrected_text)
-            external = not is_vke_related(corrected_text)
+        yes_no_triggers = [
+            "возможно ли",
+            "можно ли",
+            "нельзя ли",
+            "имею ли право",
+            "допускается ли",
+        ]
+        is_binary = any(trigger in corrected_text for trigger in yes_no_triggers)
+        is_list = is_list_request(corrected_text)
+        # до поиска: если база обновится, пока ждём GigaChat, ответ не кэшируем
+        cache_generation = answer_cache.generation
+        with deadline.stage("retrieval"):
+            query = KnowledgeQuery(corrected_text)
+            external = not is_vke_related(corrected_text, query=query)
 
             if is_list:
                 for audience in [
@@ -101,61 +419,125 @@ class VkBot:
                 ]:
                     if audience in corrected_text:
                         answer = list_projects_for_audience(audience)
-                        self.send_message(user_id, answer)
-                        return
+                        return "list", answer, None
+
+            if not external:
+                faq_answer = find_faq_answer(corrected_text, query=query)
+                if faq_answer is not None:
+                    return "faq", faq_answer, None
+
+                direct = search_knowledge(
+                    corrected_text,
+                    query=query,
+                    threshold=DIRECT_ANSWER_THRESHOLD,
+                    default=None,
+                )
+                if direct is not None:
+                    return (
+                        "direct",
+                        self.add_help_links(direct, corrected_text, query),
+                        None,
+                    )
 
             if external:
                 context = ""
             else:
-                dynamic = get_top_context(corrected_text, k=6)
                 intro = get_intro_text()
+                dynamic = get_top_context(
+                    corrected_text,
+                    k=6,
+                    query=query,
+                    token_budget=CONTEXT_TOKEN_BUDGET - count_tokens(intro),
+                )
                 context = intro + "\n\n" + dynamic
 
-            try:
+        message_id = None
+        route = "llm"
+        try:
+            flags = (external, is_binary, is_list)
+            gpt_answer = answer_cache.get(
+                corrected_text, flags, embedding=query.embedding
+            )
+            if gpt_answer is not None:
+                route = "cache"
+                logger.info(f"Ответ взят из кэша: {answer_cache.stats()}")
+            else:
+                llm_budget = deadline.budget("llm")
+                if llm_budget < MIN_LLM_BUDGET:
+                    logger.warning(
+                        f"На GigaChat осталось {llm_budget:.2f} с, ответ по базе знаний."
+                    )
+                    answer = self.fallback_answer(corrected_text, query, external)
+                    return "deadline", answer, None
+
                 logger.info("Запрос к GigaChat...")
                 start_gigachat_time = time.time()
-                gpt_answer = ask_gigachat(
+                ask_kwargs = dict(
                     user_question=corrected_text,
                     context_text=context,
                     external=external,
                     is_binary=is_binary,
                     is_list=is_list,
+                    timeout=llm_budget,
                 )
+                truncated = False
+                with stage_timer("llm"), deadline.stage("llm"):
+                    if GIGACHAT_STREAMING:
+                        gpt_answer, message_id, truncated = self.stream_answer(
+                            user_id, **ask_kwargs
+                        )
+                    else:
+                        gpt_answer = ask_gigachat(**ask_kwargs)
                 gigachat_duration = time.time() - start_gigachat_time
                 logger.info(
                     f"Запрос к GigaChat выполнен за {gigachat_duration:.2f} секунд."
                 )
+                if truncated:
+                    # неполный ответ, как и ошибка, в кэш не попадает
+                    route = "truncated"
+                else:
+                    answer_cache.put(
+                        corrected_text,
+                        flags,
+                        gpt_answer,
+                        embedding=query.embedding,
+                        generation=cache_generation,
+                    )
+
+            if not external:
+                gpt_answer = self.add_help_links(gpt_answer, corrected_text, query)
 
-                if not external and any(
-                    word in gpt_answer.lower()
-                    for word in [
-                        "проект",
-                        "участие",
-                        "курс",
-                        "обучение",
-                        "программа",
-                        "vk education",
-                    ]
-                ):
-                    links = generate_help_link(corrected_text, top_k=3)
-                    gpt_answer += f"\n\n🔗 Подробнее: \n{links}"
-
-            except Exception as e:
-                logger.error(f"GigaChat API Error: {e}")
-                gpt_answer = "Произошла ошибка при обращении к GigaChat."
-
-            self.send_message(user_id, gpt_answer)
+        except GigaChatUnavailable as e:
+            logger.warning(f"GigaChat недоступен, ответ по базе знаний: {e}")
+            answer = self.fallback_answer(corrected_text, query, external)
+            return "fallback", answer, None
 
         except Exception as e:
-            logger.error(f"Ошибка обработки события: {e}")
+            logger.error(f"GigaChat API Error: {e}")
+            gpt_answer = GIGACHAT_ERROR_MESSAGE
+            route = "error"
+
+        return route, gpt_answer, message_id
 
     def run(self):
         logger.info("Бот запущен и слушает сообщения...")
-        for event in self.longpoll.listen():
-            if event.type == VkBotEventType.MESSAGE_NEW:
-                self.handle_message(event)
+        self.dispatcher.start()
+        try:
+            for event in self.longpoll.listen():
+                if event.type == VkBotEventType.MESSAGE_NEW:
+                    self.dispatcher.submit(event.object["from_id"], event)
+        except KeyboardInterrupt:
+            logger.info("Получен сигнал остановки.")
+        finally:
+            self.refresh_stop.set()
+            self.dispatcher.shutdown()
 
 
 if __name__ == "__main__":
-    bot = VkBot()
-    bot.run()
+    if HANDLER_PROCESSES:
+        import multiprocess
+
+        multiprocess.run()
+    else:
+        bot = VkBot()
+        bot.run()
@@ -0,0 +1,118 @@
+"""Обход локального статического сайта: проверка краулера и замер времени.
+
+Запуск: python bench_crawler.py [--pages 30] [--depth 2] [--concurrency 1 4 8]
+
+Сайт генерируется во временном каталоге и раздаётся http.server на
+случайном порту; --latency добавляет задержку к каждому ответу, чтобы
+было видно выигрыш от параллельной загрузки. Проверяется, что каждая
+страница посещена ровно один раз и что картинки не запрашивались.
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from crawler import Crawler
+
+PAGE = """<html><head><link rel="stylesheet" href="/style.css"></head><body>
+<section><h2>Страница {index}</h2><p>Описание проекта номер {index} для студентов.</p>
+<img src="/image{index}.png"></section>
+{links}
+</body></html>"""
+
+
+def build_site(root, pages, fanout):
+    """Дерево страниц: у страницы i дети fanout*i+1 .. fanout*i+fanout."""
+    for i in range(pages):
+        children = range(fanout * i + 1, fanout * i + fanout + 1)
+        links = "\n".join(
+            f'<a href="/page{c}.html#top">{c}</a>' for c in children if c < pages
+        )
+        # ссылки назад и на себя проверяют дедупликацию
+        links += f'\n<a href="/page0.html">home</a><a href="/page{i}.html">self</a>'
+        with open(os.path.join(root, f"page{i}.html"), "w", encoding="utf-8") as f:
+            f.write(PAGE.format(index=i, links=links))
+    with open(os.path.join(root, "style.css"), "w") as f:
+        f.write("body { font-family: sans-serif; }")
+
+
+def expected_pages(pages, fanout, depth):
+    level, total = [0], 0
+    for _ in range(depth + 1):
+        total += len(level)
+        level = [
+            c
+            for i in level
+            for c in range(fanout * i + 1, fanout * i + fanout + 1)
+            if c < pages
+        ]
+    return total
+
+
+class Handler(SimpleHTTPRequestHandler):
+    latency = 0.0
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(root, latency):
+    Handler.latency = latency
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(Handler, directory=root)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--fanout", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--wait-until", default="domcontentloaded")
+    args = parser.parse_args()
+
+    expected = expected_pages(args.pages, args.fanout, args.depth)
+    with tempfile.TemporaryDirectory() as root:
+        build_site(root, args.pages, args.fanout)
+        server = serve(root, args.latency)
+        base = f"http://127.0.0.1:{server.server_port}/"
+        try:
+            for concurrency in args.concurrency:
+                Handler.requests.clear()
+                crawler = Crawler(
+                    concurrency=concurrency,
+                    max_depth=args.depth,
+                    wait_until=args.wait_until,
+                )
+                pages = asyncio.run(crawler.crawl(base + "page0.html", prefix=base))
+                urls = [url for url, _ in pages]
+                assert len(urls) == len(set(urls)), "страница посещена дважды"
+                assert len(urls) == expected, f"{len(urls)} страниц вместо {expected}"
+                assert not any(
+                    r.endswith(".png") for r in Handler.requests
+                ), "картинки не заблокированы"
+                print(
+                    f"concurrency={concurrency:<3} {len(pages)} страниц "
+                    f"за {crawler.last_duration:.2f} с"
+                )
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Поведение ask_gigachat при деградации GigaChat: локальная заглушка SDK.
+
+Запуск: python bench_gigachat.py [--messages 400] [--interval 0.3] [--scale 0.1]
+
+Клиент GigaChat подменяется FakeGigaChat, который отвечает с задержкой
+и ошибками по сценарию из фаз: норма, медленный хвост, отказ,
+восстановление. Каждое «сообщение» получает Deadline, как в
+handle_message; при GigaChatUnavailable засчитывается ответ по базе
+знаний. Печатает p50/p99 времени ответа, доли ответов GigaChat и
+запасных ответов, число повторных запросов и размыканий предохранителя.
+--scale сжимает все задержки и бюджеты для быстрого прогона.
+"""
+
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+import ai_gigachat
+import metrics
+from config import DEADLINE_BUDGETS, MESSAGE_DEADLINE
+from resilience import CircuitBreaker, Deadline, parse_budgets
+
+# (название, доля сообщений, медиана задержки, доля медленных, их задержка, доля ошибок)
+PHASES = [
+    ("норма", 0.3, 1.0, 0.0, 0.0, 0.0),
+    ("медленный хвост", 0.2, 1.0, 0.05, 40.0, 0.0),
+    ("отказ", 0.2, 1.0, 0.0, 0.0, 1.0),
+    # длиннее GIGACHAT_BREAKER_RECOVERY, чтобы был виден пробный запрос
+    ("восстановление", 0.3, 1.0, 0.0, 0.0, 0.0),
+]
+
+
+class Scenario:
+    def __init__(self, scale):
+        self.scale = scale
+        self.phase = PHASES[0]
+        self._lock = threading.Lock()
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+
+    def sample(self):
+        with self._lock:
+            _, _, median, slow_share, slow_delay, error_share = self.phase
+        delay = random.lognormvariate(np.log(median), 0.25)
+        if random.random() < slow_share:
+            delay = slow_delay
+        return delay * self.scale, random.random() < error_share
+
+
+class FakeGigaChat:
+    """Повторяет используемую часть интерфейса gigachat.GigaChat."""
+
+    scenario = None
+
+    def __init__(self, credentials=None, verify_ssl_certs=False, timeout=30):
+        self.timeout = timeout * self.scenario.scale
+
+    def get_token(self):
+        return SimpleNamespace(expires_at=(time.time() + 1800) * 1000)
+
+    def chat(self, chat):
+        delay, fail = self.scenario.sample()
+        # SDK сам обрывает запрос по своему таймауту
+        time.sleep(min(delay, self.timeout))
+        if fail or delay > self.timeout:
+            raise ConnectionError("заглушка: ошибка GigaChat")
+        message = SimpleNamespace(content="Ответ заглушки GigaChat.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def close(self):
+        pass
+
+
+def ask(deadline):
+    start = time.monotonic()
+    try:
+        ai_gigachat.ask_gigachat("вопрос", "контекст", timeout=deadline.budget("llm"))
+        path = "gigachat"
+    except ai_gigachat.GigaChatUnavailable:
+        path = "fallback"
+    return path, time.monotonic() - start
+
+
+def counter_value(name, **labels):
+    return metrics.counter(name, **labels).value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument(
+        "--interval", type=float, default=0.3, help="между сообщениями, с"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--scale", type=float, default=0.1)
+    args = parser.parse_args()
+
+    scenario = Scenario(args.scale)
+    FakeGigaChat.scenario = scenario
+    ai_gigachat.GigaChat = FakeGigaChat
+    ai_gigachat._pool = ai_gigachat.GigaChatPool(size=args.pool_size)
+    ai_gigachat._executor = ThreadPoolExecutor(args.pool_size * 2)
+    ai_gigachat.breaker = CircuitBreaker(
+        "gigachat", recovery_time=ai_gigachat.breaker.recovery_time * args.scale
+    )
+    budgets = {
+        stage: seconds * args.scale
+        for stage, seconds in parse_budgets(DEADLINE_BUDGETS).items()
+    }
+    total = MESSAGE_DEADLINE * args.scale
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for phase in PHASES:
+            scenario.set_phase(phase)
+            count = max(1, int(args.messages * phase[1]))
+            futures = []
+            for _ in range(count):
+                futures.append(executor.submit(ask, Deadline(total, budgets)))
+                time.sleep(args.interval * args.scale)
+            results = [future.result() for future in futures]
+            latencies = np.array([seconds for _, seconds in results]) / args.scale
+            fallback = sum(path == "fallback" for path, _ in results)
+            print(
+                f"{phase[0]:<16} n={count:<4} "
+                f"p50={np.percentile(latencies, 50):6.2f} с  "
+                f"p99={np.percentile(latencies, 99):6.2f} с  "
+                f"запасных ответов {fallback / count:5.1%}"
+            )
+
+    print(
+        f"Повторных запросов: {counter_value('vkbot_hedged_requests_total')}, "
+        f"из них первыми ответили: {counter_value('vkbot_hedged_wins_total')}; "
+        f"размыканий предохранителя: "
+        f"{counter_value('vkbot_circuit_opened_total', upstream='gigachat')}"
+    )
+    print("Время приведено к масштабу без --scale.")
+
+
+if __name__ == "__main__":
+    main()
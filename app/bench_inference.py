@@ -0,0 +1,89 @@
+"""Пропускная способность пула инференса при нескольких процессах-клиентах.
+
+Запуск: python bench_inference.py [--workers 1 2] [--clients 1 2 4] [--requests 200]
+
+Каждый клиент — отдельный процесс, имитирующий обработчик: на каждый
+вопрос один запрос эмбеддинга и один запрос токсичности, из нескольких
+потоков. Печатает вопросов в секунду для каждой пары (workers, clients).
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from multiprocess import ProcessGroup
+
+QUESTIONS = [
+    "какие курсы есть для студентов",
+    "можно ли участвовать в нескольких проектах",
+    "сколько длится стажировка в vk",
+    "что есть для школьников",
+]
+
+
+def _client_main(address, authkey, requests, threads, start, done):
+    import inference
+
+    client = inference.InferenceClient(address, authkey)
+    embedding = inference.RemoteEmbedding(client)
+    toxicity = inference.RemoteToxicity(client)
+
+    def ask(i):
+        text = QUESTIONS[i % len(QUESTIONS)] + f" {i}"
+        embedding.encode(text)
+        toxicity.score(text)
+
+    start.wait()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(ask, range(requests)))
+    done.put(requests)
+
+
+def run(workers, clients, requests, threads):
+    group = ProcessGroup(handlers=clients, inference_workers=workers)
+    group.start_inference()
+    start = group.context.Event()
+    done = group.context.Queue()
+    processes = [
+        group.context.Process(
+            target=_client_main,
+            args=(
+                group.addresses[i % workers],
+                group.authkey,
+                requests,
+                threads,
+                start,
+                done,
+            ),
+        )
+        for i in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(1)
+    began = time.perf_counter()
+    start.set()
+    total = sum(done.get() for _ in processes)
+    elapsed = time.perf_counter() - began
+    for process in processes:
+        process.join()
+    group.shutdown()
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        for clients in args.clients:
+            rate = run(workers, clients, args.requests, args.threads)
+            print(f"workers={workers:<2} clients={clients:<2} {rate:8.1f} вопросов/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Качество и скорость поиска: только векторы против гибридного BM25 + векторы.
+
+Запуск: python bench_retrieval.py [--labels bench_questions.jsonl] [--k 6]
+
+Файл разметки — JSON по одному на строку: {"question": ..., "expect": ...}.
+Найденный фрагмент считается релевантным, если его заголовок или текст
+содержит подстроку expect (без учёта регистра). Используется текущая
+база знаний (knowledge.db).
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import db
+
+
+def evaluate(labels, embeddings, k, lexical_weight):
+    db.HYBRID_LEXICAL_WEIGHT = lexical_weight
+    hits = []
+    ranks = []
+    timings = []
+    for item, embedding in zip(labels, embeddings):
+        start = time.perf_counter()
+        query = db.KnowledgeQuery(item["question"], embedding=embedding)
+        top = query.top_k(k)
+        timings.append(time.perf_counter() - start)
+
+        expect = item["expect"].lower()
+        rank = next(
+            (
+                i + 1
+                for i, (_, title, content, _) in enumerate(top)
+                if expect in f"{title} {content}".lower()
+            ),
+            None,
+        )
+        hits.append(rank is not None)
+        ranks.append(1 / rank if rank else 0.0)
+    return {
+        f"hit@{k}": float(np.mean(hits)),
+        "mrr": float(np.mean(ranks)),
+        "mean_ms": float(np.mean(timings) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--labels",
+        default=os.path.join(os.path.dirname(__file__), "bench_questions.jsonl"),
+    )
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--weight", type=float, default=db.HYBRID_LEXICAL_WEIGHT)
+    args = parser.parse_args()
+
+    with open(args.labels, encoding="utf-8") as f:
+        labels = [json.loads(line) for line in f if line.strip()]
+
+    db.init_db()
+    db.knowledge_index.load()
+    embeddings = db.embedding_model.get().encode([item["question"] for item in labels])
+
+    for name, weight in (("vector", 0.0), ("hybrid", args.weight)):
+        result = evaluate(labels, embeddings, args.k, weight)
+        print(
+            f"{name:<7} "
+            + "  ".join(f"{key}={value:.3f}" for key, value in result.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Сравнение пропускной способности классификатора токсичности.
+
+Запуск: python bench_toxicity.py [--repeat N] [--batch-size B]
+
+Режимы: fp32 по одному тексту, fp32 батчами, int8 батчами — на одних и
+тех же входных данных.
+"""
+
+import argparse
+import copy
+import time
+
+from text_utils import toxicity
+from toxicity import ToxicityClassifier, quantize_dynamic
+
+SAMPLES = [
+    "какие курсы есть для студентов",
+    "можно ли участвовать в нескольких проектах",
+    "как подать заявку на стажировку",
+    "есть ли программы для школьников",
+    "сколько длится обучение в академии",
+    "что такое vk education",
+    "нужен ли опыт для участия в треке по машинному обучению",
+    "где посмотреть расписание мероприятий для преподавателей",
+]
+
+
+def run(name, classifier, texts, batch_size):
+    start = time.perf_counter()
+    if batch_size == 1:
+        scores = [classifier.predict_batch([text])[0] for text in texts]
+    else:
+        scores = []
+        for offset in range(0, len(texts), batch_size):
+            scores.extend(classifier.predict_batch(texts[offset : offset + batch_size]))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14} {len(texts) / elapsed:8.1f} текстов/с  ({elapsed:.2f} с)")
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    texts = SAMPLES * args.repeat
+    fp32 = toxicity.get()
+    int8 = ToxicityClassifier(
+        fp32.tokenizer, quantize_dynamic(copy.deepcopy(fp32.model).cpu()), "cpu"
+    )
+
+    fp32.predict_batch(texts[:2])
+    reference = run("fp32 single", fp32, texts, 1)
+    run("fp32 batched", fp32, texts, args.batch_size)
+    quantized = run("int8 batched", int8, texts, args.batch_size)
+    drift = max(abs(a - b) for a, b in zip(reference, quantized))
+    print(f"Макс. расхождение int8 и fp32: {drift:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Полнота поиска по квантованным векторам относительно float32.
+
+Запуск: python bench_vectors.py [--queries N] [--k K] [--noise S]
+
+Запросами служат эмбеддинги из базы знаний с добавленным шумом. Для
+каждого формата хранилища считается recall@k по отношению к точному
+поиску float32, время поиска и размер векторов.
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from db import KnowledgeIndex
+from vector_store import open_store, write_store
+
+
+def top_k(scores, k):
+    return set(np.argsort(-scores)[:k].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--noise", type=float, default=0.05)
+    args = parser.parse_args()
+
+    ids, _, matrix = KnowledgeIndex.read_normalized()
+    if not ids:
+        print("База знаний пуста.")
+        return
+
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(ids), size=args.queries)
+    queries = matrix[picks] + rng.normal(0, args.noise, (args.queries, matrix.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+    reference = [top_k(matrix @ q, args.k) for q in queries]
+
+    print(f"{len(ids)} векторов, {args.queries} запросов, recall@{args.k}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ("float32", "float16", "int8"):
+            path = f"{tmp}/{dtype}"
+            write_store(path, matrix, ids, dtype, version=None)
+            store = open_store(path)
+            start = time.perf_counter()
+            found = [top_k(store.scores(q), args.k) for q in queries]
+            elapsed = (time.perf_counter() - start) / args.queries * 1000
+            recall = np.mean([len(a & b) / len(b) for a, b in zip(found, reference)])
+            print(
+                f"{dtype:<8} recall={recall:.4f}  {elapsed:.3f} мс/запрос  "
+                f"{store.vectors.nbytes / 1024:.0f} КБ"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Офлайн-бенчмарк конвейера обработки сообщений.
+
+Прогоняет корпус вопросов через VkBot.handle_message без VK, GigaChat и
+сайта: события подаются из фиктивного источника, messages.send и
+GigaChat заменены заглушками с настраиваемой задержкой, база знаний
+собирается во временном файле из FIXTURE_SECTIONS.
+
+Запуск:
+    python benchmark.py --concurrency 1 4 8 --llm-latency 1.5 --output bench.json
+
+Исходящие сообщения по умолчанию не ограничиваются VK_RATE_LIMIT, чтобы
+замер показывал сам конвейер; --vk-rate возвращает лимит.
+
+Корпус (--corpus) — текстовый файл, один вопрос на строку. Результат в
+JSON удобно сравнивать между коммитами.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import app
+import db
+from answer_cache import answer_cache
+from config import VK_RATE_LIMIT
+from dispatcher import MessageDispatcher
+from outbound import OutboundSender
+from singleflight import SingleFlight, UserRateLimiter
+
+FIXTURE_SECTIONS = [
+    (
+        "Образовательные программы для студентов",
+        "Студенты могут бесплатно пройти курсы по разработке, анализу данных и "
+        "дизайну, а также поступить в технопарки и академии VK Education.",
+        "https://education.vk.company/students",
+    ),
+    (
+        "Программы для школьников",
+        "Для школьников доступны олимпиады, кружки и летние школы по "
+        "программированию и математике с наставниками из VK.",
+        "https://education.vk.company/schoolchildren",
+    ),
+    (
+        "Стажировки",
+        "Стажировка в VK длится от трёх до шести месяцев, участники работают в "
+        "продуктовых командах и получают оплату.",
+        "https://education.vk.company/internship",
+    ),
+    (
+        "Преподавателям",
+        "Преподаватели вузов могут пройти программы повышения квалификации и "
+        "получить методические материалы по современным технологиям.",
+        "https://education.vk.company/teachers",
+    ),
+    (
+        "Участие в нескольких проектах",
+        "Участвовать в нескольких проектах одновременно можно, если нет "
+        "конфликтов по времени и требованиям каждой программы.",
+        "https://education.vk.company/faq",
+    ),
+]
+
+DEFAULT_CORPUS = [
+    "какие курсы есть для студентов",
+    "можно ли участвовать в нескольких проектах",
+    "сколько длится стажировка в vk",
+    "что есть для школьников",
+    "как преподавателю пройти повышение квалификации",
+    "какая погода завтра в москве",
+    "можно ли проходить курсы бесплатно",
+    "как поступить в академию vk education",
+]
+
+# TokenBucket с inf даёт nan, поэтому «без ограничения» — просто очень много
+UNLIMITED_RATE = 1e9
+
+STAGES = ["spelling", "toxicity", "embedding", "retrieval", "llm", "send"]
+
+
+class StageTimer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[stage].append(time.perf_counter() - start)
+
+        return timed
+
+    def summary(self):
+        result = {}
+        for stage in STAGES:
+            values = np.array(self.samples.get(stage, []), dtype=np.float64) * 1000
+            if not values.size:
+                continue
+            result[stage] = {
+                "count": int(values.size),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+            }
+        return result
+
+
+class FakeMessages:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = []
+
+    def send(self, user_id, message, random_id=None, **kwargs):
+        time.sleep(self.latency)
+        self.sent.append((user_id, message))
+        return len(self.sent)
+
+    def edit(self, peer_id, message_id, message, **kwargs):
+        time.sleep(self.latency)
+
+
+class FakeVk:
+    """Заменяет vk_api.VkApi: вызовы method() попадают в FakeMessages."""
+
+    def __init__(self, latency):
+        self.messages = FakeMessages(latency)
+
+    def method(self, method, params=None):
+        if method == "execute":
+            return self.execute(params["code"])
+        _, name = method.split(".")
+        return getattr(self.messages, name)(**(params or {}))
+
+    def execute(self, code):
+        """Разбирает код, который собирает OutboundSender: return [API.x.y({...}), ...];"""
+        decoder = json.JSONDecoder()
+        results = []
+        latency, self.messages.latency = self.messages.latency, 0
+        try:
+            time.sleep(latency)
+            position = code.find("API.")
+            while position != -1:
+                start = code.index("(", position)
+                _, name = code[position + 4 : start].split(".")
+                params, end = decoder.raw_decode(code, start + 1)
+                results.append(getattr(self.messages, name)(**params))
+                position = code.find("API.", end)
+        finally:
+            self.messages.latency = latency
+        return results
+
+
+class FakeEvent:
+    def __init__(self, user_id, text):
+        self.type = app.VkBotEventType.MESSAGE_NEW
+        self.object = {"from_id": user_id, "text": text}
+
+
+def fake_longpoll(corpus, messages, users):
+    for i in range(messages):
+        yield FakeEvent(1000 + i % users, corpus[i % len(corpus)])
+
+
+def gigachat_stub(latency, jitter):
+    def ask(user_question, context_text, **kwargs):
+        time.sleep(max(0.0, random.gauss(latency, jitter)))
+        return f"По вашему вопросу «{user_question}» подходит проект VK Education."
+
+    return ask
+
+
+def build_fixture_db(path):
+    db.DB_PATH = path
+    db.init_db()
+    db.save_to_db(db.embed_sections(FIXTURE_SECTIONS))
+
+
+def instrument(timer, llm):
+    encoder = db.embedding_model.get()
+    encoder.encode = timer.wrap("embedding", encoder.encode)
+    db.knowledge_index.scores = timer.wrap("retrieval", db.knowledge_index.scores)
+    app.correct_spelling = timer.wrap("spelling", app.correct_spelling)
+    app.contains_profanity = timer.wrap("toxicity", app.contains_profanity)
+    app.get_top_context = timer.wrap("retrieval", app.get_top_context)
+    app.generate_help_link = timer.wrap("retrieval", app.generate_help_link)
+    app.ask_gigachat = timer.wrap("llm", llm)
+
+
+def make_bot(vk, timer, vk_rate=UNLIMITED_RATE):
+    bot = app.VkBot.__new__(app.VkBot)
+    bot.vk = vk
+    vk.messages.send = timer.wrap("send", vk.messages.send)
+    # по умолчанию лимит VK не ограничивает замер: заглушка отвечает сама
+    bot.sender = OutboundSender(vk, rate=vk_rate)
+    bot.single_flight = SingleFlight()
+    # в корпусе пользователи повторяют вопросы, лимит исказил бы замер
+    bot.rate_limiter = UserRateLimiter(per_minute=1e9, burst=10**6, repeat_window=0)
+    return bot
+
+
+def run_level(bot, corpus, concurrency, messages, users):
+    answer_cache.clear()
+    bot.single_flight = SingleFlight()
+    dispatcher = MessageDispatcher(
+        bot.handle_message, workers=concurrency, queue_size=messages
+    )
+    dispatcher.start()
+    start = time.perf_counter()
+    for event in fake_longpoll(corpus, messages, users):
+        dispatcher.submit(event.object["from_id"], event)
+    dispatcher.shutdown()
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "messages": messages,
+        "seconds": elapsed,
+        "throughput_msg_s": messages / elapsed,
+        "answer_cache": answer_cache.stats(),
+        "single_flight": bot.single_flight.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="файл с вопросами, по одному на строку")
+    parser.add_argument("--messages", type=int, default=64)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--send-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--vk-rate",
+        type=float,
+        default=UNLIMITED_RATE,
+        help=f"лимит вызовов VK в секунду (без ограничения; {VK_RATE_LIMIT} — как в работе)",
+    )
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [line.strip() for line in f if line.strip()]
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp:
+        build_fixture_db(os.path.join(tmp, "knowledge.db"))
+        instrument(timer, gigachat_stub(args.llm_latency, args.llm_jitter))
+        vk = FakeVk(args.send_latency)
+        bot = make_bot(vk, timer, args.vk_rate)
+        bot.handle_message(FakeEvent(0, corpus[0]))
+        timer.samples.clear()
+
+        levels = [
+            run_level(bot, corpus, n, args.messages, args.users)
+            for n in args.concurrency
+        ]
+
+    report = {
+        "stages": timer.summary(),
+        "levels": levels,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "sent": len(vk.messages.sent),
+    }
+
+    for level in levels:
+        print(
+            f"concurrency={level['concurrency']:<3} "
+            f"{level['throughput_msg_s']:7.2f} msg/s  ({level['seconds']:.2f} с), "
+            f"объединено {level['single_flight']['shared']}"
+        )
+    for stage, stats in report["stages"].items():
+        print(
+            f"{stage:<10} p50={stats['p50_ms']:8.1f} мс  "
+            f"p95={stats['p95_ms']:8.1f} мс  p99={stats['p99_ms']:8.1f} мс"
+        )
+    print(f"Пиковая память: {report['peak_rss_mb']:.0f} МБ")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
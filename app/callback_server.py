@@ -0,0 +1,187 @@
+"""Режим Callback API: VK присылает события HTTP-запросами.
+
+Запуск сервера:
+    python callback_server.py
+
+Локальная проверка — отправка записанных событий (JSON по одному на строку):
+    python callback_server.py --post payloads.jsonl --url http://127.0.0.1:8080/
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+
+from config import (
+    CALLBACK_HOST,
+    CALLBACK_PORT,
+    CALLBACK_SECRET,
+    CONFIRMATION_TOKEN,
+    VK_GROUP_ID,
+)
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class CallbackEvent:
+    """Событие в том же виде, что и из longpoll: type и object с from_id/text."""
+
+    def __init__(self, payload):
+        self.type = payload.get("type")
+        obj = payload.get("object") or {}
+        self.object = obj.get("message", obj)
+        self.event_id = payload.get("event_id")
+
+
+class RecentEvents:
+    """Ограниченное множество недавно принятых event_id для отсева повторов."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+
+    def __contains__(self, event_id):
+        return event_id in self._ids
+
+    def add(self, event_id):
+        self._ids[event_id] = None
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+
+class CallbackHandler:
+    """Разбирает события Callback API и передаёт их диспетчеру бота."""
+
+    def __init__(self, dispatcher, group_id=VK_GROUP_ID, secret=CALLBACK_SECRET):
+        self.dispatcher = dispatcher
+        self.group_id = str(group_id) if group_id else None
+        self.secret = secret
+        self.recent = RecentEvents()
+
+    def handle(self, payload):
+        """Возвращает (HTTP-статус, тело ответа)."""
+        if self.secret and payload.get("secret") != self.secret:
+            return 403, "forbidden"
+        if self.group_id and str(payload.get("group_id")) != self.group_id:
+            return 403, "forbidden"
+
+        if payload.get("type") == "confirmation":
+            return 200, CONFIRMATION_TOKEN or ""
+
+        event = CallbackEvent(payload)
+        if event.event_id and event.event_id in self.recent:
+            counter("vkbot_callback_duplicates_total", "Повторные доставки").inc()
+            return 200, "ok"
+
+        if event.type == "message_new":
+            if not self.dispatcher.try_submit(event.object.get("from_id"), event):
+                # Не отвечаем "ok": VK повторит доставку позже
+                logger.warning("Очередь обработки переполнена, событие отклонено.")
+                counter("vkbot_callback_rejected_total", "Отклонённые события").inc()
+                return 503, "busy"
+
+        if event.event_id:
+            self.recent.add(event.event_id)
+        return 200, "ok"
+
+
+async def _respond(writer, status, body):
+    reason = {200: "OK", 400: "Bad Request", 403: "Forbidden", 503: "Busy"}
+    data = body.encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {reason.get(status, 'Error')}\r\n"
+        f"Content-Type: text/plain; charset=utf-8\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        f"Connection: close\r\n\r\n".encode("ascii") + data
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def _serve_connection(handler, reader, writer):
+    try:
+        request_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if not request_line.startswith(b"POST"):
+            await _respond(writer, 200, "ok")
+            return
+
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            await _respond(writer, 400, "too large")
+            return
+        payload = json.loads(await reader.readexactly(length))
+        status, body = handler.handle(payload)
+        await _respond(writer, status, body)
+    except (ValueError, asyncio.IncompleteReadError) as e:
+        logger.warning(f"Некорректный запрос Callback API: {e}")
+        await _respond(writer, 400, "bad request")
+    except Exception as e:
+        logger.error(f"Ошибка обработки запроса Callback API: {e}")
+        writer.close()
+
+
+async def serve(handler, host=CALLBACK_HOST, port=CALLBACK_PORT):
+    server = await asyncio.start_server(
+        lambda r, w: _serve_connection(handler, r, w), host, port
+    )
+    logger.info(f"Callback API слушает http://{host}:{port}/")
+    async with server:
+        await server.serve_forever()
+
+
+def run_callback_bot():
+    from app import VkBot
+
+    bot = VkBot(use_longpoll=False)
+    bot.dispatcher.start()
+    try:
+        asyncio.run(serve(CallbackHandler(bot.dispatcher)))
+    except KeyboardInterrupt:
+        logger.info("Получен сигнал остановки.")
+    finally:
+        bot.refresh_stop.set()
+        bot.dispatcher.shutdown()
+
+
+def post_payloads(path, url):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(
+                url,
+                data=line.strip().encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+            try:
+                with urllib.request.urlopen(request) as response:
+                    print(response.status, response.read().decode("utf-8"))
+            except urllib.error.HTTPError as e:
+                print(e.code, e.read().decode("utf-8"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--post", help="файл с записанными событиями для отправки")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{CALLBACK_PORT}/")
+    args = parser.parse_args()
+
+    if args.post:
+        post_payloads(args.post, args.url)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        run_callback_bot()
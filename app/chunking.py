@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import re
+
+from config import CHUNK_MAX_WORDS, NEAR_DUPLICATE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+SHINGLE_SIZE = 3
+
+
+def split_into_chunks(text, max_words=CHUNK_MAX_WORDS):
+    """Делит текст на фрагменты до max_words слов по границам предложений."""
+    chunks = []
+    current = []
+    count = 0
+    for sentence in _SENTENCE_RE.split(text):
+        words = sentence.split()
+        if not words:
+            continue
+        # Слишком длинное предложение режем по словам
+        while len(words) > max_words:
+            if current:
+                chunks.append(" ".join(current))
+                current, count = [], 0
+            chunks.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if count + len(words) > max_words and current:
+            chunks.append(" ".join(current))
+            current, count = [], 0
+        current.append(" ".join(words))
+        count += len(words)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def _normalized(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _shingles(text):
+    words = text.split()
+    if len(words) <= SHINGLE_SIZE:
+        return {text}
+    return {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def _size(sections):
+    return len(sections), sum(len(content.split()) for _, content, _ in sections)
+
+
+def normalize_sections(
+    sections, max_words=CHUNK_MAX_WORDS, threshold=NEAR_DUPLICATE_THRESHOLD
+):
+    """Режет разделы на фрагменты и убирает повторы.
+
+    Каждый фрагмент сохраняет происхождение: url страницы и заголовок
+    раздела. Точные повторы отсеиваются по хэшу нормализованного текста,
+    почти одинаковые и вложенные — по доле общих шинглов из слов.
+    """
+    chunks = []
+    for title, content, url in sections:
+        for chunk in split_into_chunks(content, max_words):
+            chunks.append((title, chunk, url))
+
+    # Длинные фрагменты первыми: короткий фрагмент, целиком входящий в уже
+    # принятый (карточка внутри раздела), отбрасывается
+    order = sorted(range(len(chunks)), key=lambda i: -len(chunks[i][1]))
+    seen_hashes = set()
+    kept_ids = []
+    kept_shingles = []
+    for i in order:
+        normalized = _normalized(chunks[i][1])
+        if not normalized:
+            continue
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        if digest in seen_hashes:
+            continue
+        seen_hashes.add(digest)
+
+        shingles = _shingles(normalized)
+        if any(
+            len(shingles & other) >= threshold * len(shingles)
+            for other in kept_shingles
+        ):
+            continue
+        kept_ids.append(i)
+        kept_shingles.append(shingles)
+    kept = [chunks[i] for i in sorted(kept_ids)]
+
+    before, after = _size(sections), _size(kept)
+    logger.info(
+        f"Нормализация: {before[0]} разделов / {before[1]} слов -> "
+        f"{after[0]} фрагментов / {after[1]} слов"
+    )
+    return kept
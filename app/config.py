@@ -14,3 +14,105 @@ GIGACHAT_AUTH_KEY = os.getenv("GIGACHAT_AUTH_KEY")
 
 DB_PATH = "knowledge.db"
 SITE_URL = "https://education.vk.company/"
+
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "8"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+
+GIGACHAT_POOL_SIZE = int(os.getenv("GIGACHAT_POOL_SIZE", "4"))
+GIGACHAT_TIMEOUT = float(os.getenv("GIGACHAT_TIMEOUT", "30"))
+GIGACHAT_TOKEN_REFRESH_MARGIN = float(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", "60"))
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+KNOWLEDGE_REFRESH_DAYS = float(os.getenv("KNOWLEDGE_REFRESH_DAYS", "4"))
+# обновление отбрасывается, если с сайта пришло меньше этой доли сохранённых разделов
+KNOWLEDGE_REFRESH_MIN_RATIO = float(os.getenv("KNOWLEDGE_REFRESH_MIN_RATIO", "0.5"))
+KNOWLEDGE_REFRESH_CHECK_INTERVAL = float(
+    os.getenv("KNOWLEDGE_REFRESH_CHECK_INTERVAL", "3600")
+)
+
+SPELL_CACHE_SIZE = int(os.getenv("SPELL_CACHE_SIZE", "50000"))
+
+TOXICITY_BATCH_SIZE = int(os.getenv("TOXICITY_BATCH_SIZE", "16"))
+TOXICITY_BATCH_WAIT_MS = float(os.getenv("TOXICITY_BATCH_WAIT_MS", "5"))
+TOXICITY_QUANTIZE = os.getenv("TOXICITY_QUANTIZE", "0") == "1"
+
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "local_model")
+MODELS_OFFLINE = os.getenv("MODELS_OFFLINE", "0") == "1"
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+
+GIGACHAT_STREAMING = os.getenv("GIGACHAT_STREAMING", "0") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+CALLBACK_HOST = os.getenv("CALLBACK_HOST", "0.0.0.0")
+CALLBACK_PORT = int(os.getenv("CALLBACK_PORT", "8080"))
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET")
+
+VK_RATE_LIMIT = float(os.getenv("VK_RATE_LIMIT", "20"))
+VK_EXECUTE_BATCH = int(os.getenv("VK_EXECUTE_BATCH", "25"))
+VK_SEND_RETRIES = int(os.getenv("VK_SEND_RETRIES", "5"))
+
+# "", "float32", "float16" или "int8"; пусто — векторы только в памяти процесса
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "")
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "knowledge_vectors")
+
+CHUNK_MAX_WORDS = int(os.getenv("CHUNK_MAX_WORDS", "120"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+# Токенизатор не GigaChat, а локальная замена: бюджет контекста считается
+# приближённо. Поправочный коэффициент подбирается по tokens_count GigaChat
+# на CONTEXT_TOKEN_CALIBRATION_SAMPLES фрагментах базы (0 — без калибровки).
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cointegrated/rubert-tiny-toxicity")
+CONTEXT_TOKEN_CALIBRATION_SAMPLES = int(
+    os.getenv("CONTEXT_TOKEN_CALIBRATION_SAMPLES", "20")
+)
+
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "200"))
+HYBRID_SHORTLIST_MIN_ROWS = int(os.getenv("HYBRID_SHORTLIST_MIN_ROWS", "5000"))
+
+FAQ_PATH = os.getenv("FAQ_PATH", "faq.jsonl")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.9"))
+DIRECT_ANSWER_THRESHOLD = float(os.getenv("DIRECT_ANSWER_THRESHOLD", "0.85"))
+
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "1"))
+# load, domcontentloaded, networkidle или commit
+CRAWL_WAIT_UNTIL = os.getenv("CRAWL_WAIT_UNTIL", "domcontentloaded")
+CRAWL_PAGE_TIMEOUT = float(os.getenv("CRAWL_PAGE_TIMEOUT", "30"))
+CRAWL_BLOCK_RESOURCES = os.getenv("CRAWL_BLOCK_RESOURCES", "image,font,media")
+
+# Допустимая частота сообщений от одного пользователя и запас на всплеск
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "10"))
+USER_RATE_BURST = int(os.getenv("USER_RATE_BURST", "3"))
+USER_REPEAT_WINDOW = float(os.getenv("USER_REPEAT_WINDOW", "30"))
+
+# 0 — всё в одном процессе; N > 0 — N процессов-обработчиков (multiprocess.py)
+HANDLER_PROCESSES = int(os.getenv("HANDLER_PROCESSES", "0"))
+KNOWLEDGE_WATCH_INTERVAL = float(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "5"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "32"))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "5"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "10"))
+HANDLER_SUBMIT_TIMEOUT = float(os.getenv("HANDLER_SUBMIT_TIMEOUT", "2"))
+SUPERVISOR_INTERVAL = float(os.getenv("SUPERVISOR_INTERVAL", "2"))
+
+# Общий бюджет времени на сообщение и его доли по этапам, в секундах
+MESSAGE_DEADLINE = float(os.getenv("MESSAGE_DEADLINE", "25"))
+DEADLINE_BUDGETS = os.getenv(
+    "DEADLINE_BUDGETS", "spelling=1,toxicity=1,retrieval=3,llm=15,send=3"
+)
+# Повторный запрос уходит, если ответа нет дольше этого перцентиля; 0 — без него
+GIGACHAT_HEDGE_PERCENTILE = int(os.getenv("GIGACHAT_HEDGE_PERCENTILE", "95"))
+GIGACHAT_HEDGE_MIN_SAMPLES = int(os.getenv("GIGACHAT_HEDGE_MIN_SAMPLES", "20"))
+GIGACHAT_BREAKER_FAILURES = int(os.getenv("GIGACHAT_BREAKER_FAILURES", "5"))
+GIGACHAT_BREAKER_RECOVERY = float(os.getenv("GIGACHAT_BREAKER_RECOVERY", "30"))
@@ -0,0 +1,150 @@
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+from config import CONTEXT_MMR_LAMBDA, CONTEXT_TOKENIZER, MODEL_CACHE_DIR
+from models import lazy_model
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+_WORD_RE = re.compile(r"\w+")
+STEM_LENGTH = 5
+
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+
+    local_path = os.path.join(MODEL_CACHE_DIR, CONTEXT_TOKENIZER.split("/")[-1])
+    if os.path.exists(local_path):
+        return AutoTokenizer.from_pretrained(local_path)
+    return AutoTokenizer.from_pretrained(CONTEXT_TOKENIZER)
+
+
+tokenizer = lazy_model("tokenizer", _load_tokenizer)
+_tokenizer_failed = False
+# отношение токенов GigaChat к токенам CONTEXT_TOKENIZER, см. calibrate_token_count
+_token_scale = 1.0
+_calibrated_for = None
+
+
+def _count_proxy_tokens(text):
+    global _tokenizer_failed
+    if not _tokenizer_failed:
+        try:
+            return len(tokenizer.get().encode(text, add_special_tokens=False))
+        except Exception as e:
+            _tokenizer_failed = True
+            logger.warning(f"Токенизатор недоступен, оценка по словам: {e}")
+    return int(len(text.split()) * 1.5) + 1
+
+
+def count_tokens(text):
+    """Оценка числа токенов GigaChat для текста.
+
+    Считает локальный токенизатор (или слова, если он недоступен), результат
+    умножается на коэффициент из calibrate_token_count.
+    """
+    return math.ceil(_count_proxy_tokens(text) * _token_scale)
+
+
+def calibrate_token_count(samples, reference_counts):
+    """Подбирает коэффициент count_tokens по настоящему токенизатору.
+
+    reference_counts(texts) возвращает число токенов GigaChat для каждого
+    текста. Для уже откалиброванного набора samples повторного запроса нет.
+    """
+    global _token_scale, _calibrated_for
+    samples = [text for text in samples if text]
+    key = hash(tuple(samples))
+    if not samples or key == _calibrated_for:
+        return _token_scale
+    proxy = sum(_count_proxy_tokens(text) for text in samples)
+    reference = sum(reference_counts(samples))
+    if proxy and reference:
+        _token_scale = reference / proxy
+        _calibrated_for = key
+        logger.info(
+            f"Токены GigaChat / локальная оценка: {_token_scale:.2f} "
+            f"({reference} / {proxy} на {len(samples)} фрагментах)"
+        )
+    return _token_scale
+
+
+def _stems(text):
+    return {word[:STEM_LENGTH] for word in _WORD_RE.findall(text.lower())}
+
+
+def select_mmr(vectors, relevance, k, diversity=CONTEXT_MMR_LAMBDA):
+    """Maximal Marginal Relevance: индексы k строк vectors.
+
+    Каждый следующий фрагмент выбирается по relevance с штрафом за сходство
+    с уже выбранными, чтобы не набирать почти одинаковые куски.
+    """
+    selected = []
+    candidates = list(range(len(vectors)))
+    while candidates and len(selected) < k:
+        if selected:
+            redundancy = (vectors[candidates] @ vectors[selected].T).max(axis=1)
+        else:
+            redundancy = np.zeros(len(candidates))
+        mmr = diversity * relevance[candidates] - (1 - diversity) * redundancy
+        best = candidates[int(np.argmax(mmr))]
+        selected.append(best)
+        candidates.remove(best)
+    return selected
+
+
+def trim_to_relevant(text, question_stems, budget):
+    """Оставляет предложения, больше всего пересекающиеся с вопросом.
+
+    Предложения выбираются по убыванию пересечения основ слов с вопросом,
+    пока укладываются в budget токенов, и выводятся в исходном порядке.
+    """
+    sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(_stems(sentences[i]) & question_stems), i),
+    )
+    chosen = []
+    used = 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i])
+        if used + tokens > budget:
+            continue
+        chosen.append(i)
+        used += tokens
+    return " ".join(sentences[i] for i in sorted(chosen)), used
+
+
+def assemble(question, candidates, vectors, k, budget):
+    """Собирает контекст из candidates [(score, title, content, url)].
+
+    vectors — нормированные эмбеддинги кандидатов. Возвращает (текст,
+    число токенов).
+    """
+    if not candidates or budget <= 0:
+        return "", 0
+    relevance = np.array([score for score, *_ in candidates], dtype=np.float32)
+    order = select_mmr(vectors, relevance, k)
+    question_stems = _stems(question)
+    per_chunk = max(budget // len(order), 1)
+
+    parts = []
+    used = 0
+    for i in order:
+        _, title, content, _ = candidates[i]
+        header = f"{title}:\n"
+        header_tokens = count_tokens(header)
+        room = min(per_chunk, budget - used) - header_tokens
+        if room <= 0:
+            continue
+        text, tokens = trim_to_relevant(content, question_stems, room)
+        if not text:
+            continue
+        parts.append(header + text)
+        used += header_tokens + tokens
+    return "\n\n".join(parts), used
@@ -0,0 +1,139 @@
+"""Параллельный обход сайта на асинхронном API Playwright.
+
+Один браузер на весь обход, не больше concurrency открытых страниц.
+Картинки, шрифты и медиа не загружаются. Ссылки обходятся в ширину до
+max_depth, каждый URL посещается один раз.
+"""
+
+import asyncio
+import logging
+import time
+from urllib.parse import urljoin, urldefrag
+
+from bs4 import BeautifulSoup
+
+from config import (
+    CRAWL_BLOCK_RESOURCES,
+    CRAWL_CONCURRENCY,
+    CRAWL_MAX_DEPTH,
+    CRAWL_PAGE_TIMEOUT,
+    CRAWL_WAIT_UNTIL,
+)
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_url(url):
+    return urldefrag(url)[0]
+
+
+def extract_links(html, page_url, prefix):
+    soup = BeautifulSoup(html, "html.parser")
+    links = []
+    for link in soup.find_all("a", href=True):
+        url = normalize_url(urljoin(page_url, link["href"].strip()))
+        if url.startswith(prefix):
+            links.append(url)
+    return links
+
+
+class Crawler:
+    def __init__(
+        self,
+        concurrency=CRAWL_CONCURRENCY,
+        max_depth=CRAWL_MAX_DEPTH,
+        wait_until=CRAWL_WAIT_UNTIL,
+        page_timeout=CRAWL_PAGE_TIMEOUT,
+        block_resources=CRAWL_BLOCK_RESOURCES,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_depth = max_depth
+        self.wait_until = wait_until
+        self.page_timeout = page_timeout
+        self.blocked = {r.strip() for r in block_resources.split(",") if r.strip()}
+        self.last_duration = None
+
+    async def _route(self, route):
+        if route.request.resource_type in self.blocked:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _fetch(self, context, url):
+        page = await context.new_page()
+        try:
+            start = time.perf_counter()
+            await page.goto(
+                url, wait_until=self.wait_until, timeout=self.page_timeout * 1000
+            )
+            html = await page.content()
+            histogram(
+                "vkbot_crawl_page_seconds", "Время загрузки одной страницы"
+            ).observe(time.perf_counter() - start)
+            return html
+        finally:
+            await page.close()
+
+    async def crawl(self, start_url, prefix=None):
+        """Возвращает [(url, html)] в порядке обхода в ширину."""
+        from playwright.async_api import async_playwright
+
+        prefix = prefix or start_url
+        start = time.perf_counter()
+        seen = {normalize_url(start_url)}
+        frontier = [normalize_url(start_url)]
+        pages = []
+        failed = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            context = await browser.new_context()
+            if self.blocked:
+                await context.route("**/*", self._route)
+
+            async def visit(url):
+                async with semaphore:
+                    logger.info(f"Парсинг: {url}")
+                    return await self._fetch(context, url)
+
+            try:
+                for depth in range(self.max_depth + 1):
+                    if not frontier:
+                        break
+                    results = await asyncio.gather(
+                        *(visit(url) for url in frontier), return_exceptions=True
+                    )
+                    next_frontier = []
+                    for url, html in zip(frontier, results):
+                        if isinstance(html, Exception):
+                            if depth == 0:
+                                # без стартовой страницы обход бессмыслен, и
+                                # пустой результат нельзя принять за «сайт пуст»
+                                raise RuntimeError(
+                                    f"стартовая страница {url} недоступна: {html}"
+                                ) from html
+                            failed += 1
+                            logger.warning(f"Ошибка парсинга {url}: {html}")
+                            continue
+                        pages.append((url, html))
+                        if depth < self.max_depth:
+                            for link in extract_links(html, url, prefix):
+                                if link not in seen:
+                                    seen.add(link)
+                                    next_frontier.append(link)
+                    frontier = next_frontier
+            finally:
+                await browser.close()
+
+        self.last_duration = time.perf_counter() - start
+        logger.info(
+            f"Обход сайта: {len(pages)} страниц, ошибок {failed}, "
+            f"{self.last_duration:.2f} секунд."
+        )
+        return pages
+
+
+def crawl_site(start_url, prefix=None, **kwargs):
+    return asyncio.run(Crawler(**kwargs).crawl(start_url, prefix))
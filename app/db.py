@@ -1,45 +1,69 @@
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
+from collections import namedtuple
 
 from datetime import datetime, timedelta
 import sqlite3
 from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
-from urllib.parse import urljoin
 from numpy.linalg import norm
 import numpy as np
-from playwright.sync_api import sync_playwright
-from config import DB_PATH, SITE_URL
-
-model_path = "local_model/all-MiniLM-L6-v2"
-
-if not os.path.exists(model_path):
-    print("Загрузка модели и сохранение локально...")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    model.save(model_path)
-else:
-    print("Модель уже сохранена локально.")
-
-model = SentenceTransformer(model_path)
+from config import (
+    DB_PATH,
+    SITE_URL,
+    EMBEDDING_BATCH_SIZE,
+    KNOWLEDGE_REFRESH_DAYS,
+    KNOWLEDGE_REFRESH_CHECK_INTERVAL,
+    KNOWLEDGE_REFRESH_MIN_RATIO,
+    MODEL_CACHE_DIR,
+    VECTOR_STORE_DTYPE,
+    VECTOR_STORE_PATH,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_CANDIDATES,
+    HYBRID_LEXICAL_WEIGHT,
+    HYBRID_CANDIDATES,
+    HYBRID_SHORTLIST_MIN_ROWS,
+    FAQ_MATCH_THRESHOLD,
+    CRAWL_MAX_DEPTH,
+    KNOWLEDGE_WATCH_INTERVAL,
+)
+from models import lazy_model
+from metrics import stage_timer, timed
+from vector_store import open_store, read_version, write_store
+from chunking import normalize_sections
+from context_builder import assemble as assemble_context
+from crawler import crawl_site
+import lexical
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def _load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    model_path = os.path.join(MODEL_CACHE_DIR, EMBEDDING_MODEL_NAME)
+    if not os.path.exists(model_path):
+        logger.info("Загрузка модели и сохранение локально...")
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        model.save(model_path)
+        return model
+    return SentenceTransformer(model_path)
+
+
+embedding_model = lazy_model("embedding", _load_embedding_model)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_rendered_html(url):
-    with sync_playwright() as p:
-        browser = p.romium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(url, timeout=60000)
-        page.wait_for_load_state("networkidle")
-        html = page.content()
-        browser.close()
-        return html
-
-
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    # WAL: читатели видят прежний снимок, пока обновление не закоммичено
+    cursor.execute("PRAGMA journal_mode=WAL")
 
     cursor.execute(
         """
@@ -49,10 +73,17 @@ def init_db():
             content TEXT,
             url TEXT,
             content_embedding BLOB,
-            last_updated TIMESTAMP
+            last_updated TIMESTAMP,
+            content_hash TEXT
         )
         """
     )
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(knowledge)")]
+    if "content_hash" not in columns:
+        cursor.execute("ALTER TABLE knowledge ADD COLUMN content_hash TEXT")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_content_hash ON knowledge (content_hash)"
+    )
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_title_hash ON knowledge (title)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_url_hash ON knowledge (url)")
 
@@ -64,103 +95,498 @@ def init_db():
         )
         """
     )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS faq (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT UNIQUE,
+            answer TEXT,
+            question_embedding BLOB
+        )
+        """
+    )
+    lexical.create_table(cursor)
     conn.commit()
+
+    knowledge_rows = cursor.execute("SELECT COUNT(*) FROM knowledge").fetchone()[0]
+    indexed_rows = cursor.execute(
+        f"SELECT COUNT(*) FROM {lexical.FTS_TABLE}"
+    ).fetchone()[0]
+    if knowledge_rows and not indexed_rows:
+        lexical.rebuild(conn)
     conn.close()
 
 
-def cosine_similarity(a, b):
-    return float(np.dot(a, b) / (norm(a) * norm(b)))
+class StoredRows:
+    """Ленивый доступ к (title, content, url) по id строк таблицы knowledge.
+
+    Используется с векторным хранилищем: текст читается из SQLite только для
+    тех строк, к которым действительно обращаются (обычно top-k). Несколько
+    строк сразу читает fetch() одним запросом.
+    """
+
+    CACHE_SIZE = 1024
+    # с запасом ниже SQLITE_MAX_VARIABLE_NUMBER старых сборок (999)
+    FETCH_CHUNK = 500
+
+    def __init__(self, ids):
+        self.ids = ids
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.fetch([i])[0]
+
+    def fetch(self, indices):
+        """Строки по позициям indices; недостающие в кэше — одним SELECT."""
+        row_ids = [int(self.ids[i]) for i in indices]
+        with self._lock:
+            found = {
+                row_id: self._cache[row_id]
+                for row_id in row_ids
+                if row_id in self._cache
+            }
+        missing = sorted(set(row_ids) - found.keys())
+        if missing:
+            conn = sqlite3.connect(DB_PATH)
+            loaded = {}
+            for start in range(0, len(missing), self.FETCH_CHUNK):
+                chunk = missing[start : start + self.FETCH_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for row_id, title, content, url in conn.execute(
+                    "SELECT id, title, content, url FROM knowledge "
+                    f"WHERE id IN ({placeholders})",
+                    chunk,
+                ):
+                    loaded[row_id] = (title, content, url)
+            conn.close()
+            with self._lock:
+                if len(self._cache) + len(missing) > self.CACHE_SIZE:
+                    self._cache.clear()
+                for row_id in missing:
+                    row = loaded.get(row_id, ("", "", None))
+                    self._cache[row_id] = found[row_id] = row
+        return [found[row_id] for row_id in row_ids]
+
+    def __iter__(self):
+        conn = sqlite3.connect(DB_PATH)
+        by_id = {
+            row_id: (title, content, url)
+            for row_id, title, content, url in conn.execute(
+                "SELECT id, title, content, url FROM knowledge"
+            )
+        }
+        conn.close()
+        return iter([by_id.get(int(row_id), ("", "", None)) for row_id in self.ids])
+
+
+IndexSnapshot = namedtuple("IndexSnapshot", ["vectors", "rows", "positions"])
+
+
+class KnowledgeIndex:
+    """Резидентный индекс эмбеддингов таблицы knowledge.
+
+    Хранит нормированную матрицу float32 и соответствующие строки, так что
+    поиск сводится к одному матрично-векторному произведению. Если задан
+    VECTOR_STORE_DTYPE, векторы читаются из отображённого в память файла
+    (float16/int8), а текст — из SQLite только для найденных строк.
+    """
+
+    def __init__(self, store_dtype=VECTOR_STORE_DTYPE, store_path=VECTOR_STORE_PATH):
+        self.store_dtype = store_dtype
+        self.store_path = store_path
+        # хранилище пишет только главный процесс, обработчики его читают
+        self.writer = True
+        self._lock = threading.Lock()
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._store = None
+        self._rows = []
+        self._positions = {}
+        self._loaded = False
+
+    @staticmethod
+    def read_normalized():
+        """Читает эмбеддинги из SQLite: (ids, строки, нормированная матрица)."""
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, title, content, url, content_embedding FROM knowledge "
+            "ORDER BY id"
+        )
+        fetched = cursor.fetchall()
+        conn.close()
+
+        ids = []
+        rows = []
+        vectors = []
+        for row_id, title, content, url, embedding in fetched:
+            if embedding is None:
+                continue
+            ids.append(row_id)
+            rows.append((title, content, url))
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+
+        if vectors:
+            matrix = np.vstack(vectors).astype(np.float32, copy=False)
+            norms = norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        return ids, rows, matrix
+
+    def load(self):
+        if self.store_dtype:
+            self._load_store()
+            return
+
+        ids, rows, matrix = self.read_normalized()
+        with self._lock:
+            self._matrix = matrix
+            self._store = None
+            self._rows = rows
+            self._positions = {row_id: pos for pos, row_id in enumerate(ids)}
+            self._loaded = True
+        logger.info(f"Индекс знаний загружен: {len(rows)} записей.")
+
+    def _load_store(self):
+        store = open_store(self.store_path)
+        if self.writer:
+            version = get_meta_value("last_updated")
+            if (
+                store is None
+                or store.version != version
+                or store.dtype != self.store_dtype
+            ):
+                ids, _, matrix = self.read_normalized()
+                if ids:
+                    write_store(self.store_path, matrix, ids, self.store_dtype, version)
+                    store = open_store(self.store_path)
+        elif store is not None and store.dtype != self.store_dtype:
+            logger.warning(
+                f"Векторное хранилище {self.store_path} в формате {store.dtype}, "
+                f"ожидался {self.store_dtype}; ждём перезаписи главным процессом"
+            )
+            store = None
+        if store is None and not self.writer and self._loaded:
+            # хранилище ещё не записано или повреждено: остаёмся на текущем
+            # снимке, store watcher попробует снова на следующей проверке
+            return
+        rows = StoredRows(store.ids) if store is not None else []
+        with self._lock:
+            self._store = store
+            self._rows = rows
+            self._positions = (
+                {int(row_id): pos for pos, row_id in enumerate(store.ids)}
+                if store is not None
+                else {}
+            )
+            self._loaded = True
+        logger.info(
+            f"Индекс знаний загружен из {self.store_path}: {len(rows)} записей "
+            f"({self.store_dtype})."
+        )
 
+    def snapshot(self):
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            return IndexSnapshot(
+                self._store if self._store is not None else self._matrix,
+                self._rows,
+                self._positions,
+            )
+
+    def __len__(self):
+        return len(self.snapshot().rows)
+
+    @property
+    def version(self):
+        store = self._store
+        return store.version if store is not None else None
+
+    def scores(self, query_embedding, snapshot=None):
+        vectors, rows, _ = snapshot or self.snapshot()
+        if not len(rows):
+            return np.empty(0, dtype=np.float32), rows
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = norm(query)
+        if query_norm == 0:
+            return np.zeros(len(rows), dtype=np.float32), rows
+        query = query / query_norm
+        if isinstance(vectors, np.ndarray):
+            return vectors @ query, rows
+        return vectors.scores(query), rows
+
+    def top_k(self, query_embedding, k):
+        """Возвращает список (score, title, content, url) по убыванию score."""
+        scores, rows = self.scores(query_embedding)
+        return top_k_from_scores(scores, rows, k)
+
+
+def row_vectors(vectors, indices):
+    """Нормированные float32-векторы строк indices из матрицы или хранилища."""
+    if isinstance(vectors, np.ndarray):
+        return vectors[indices]
+    block = vectors.vectors[indices].astype(np.float32)
+    if vectors.dtype == "int8":
+        block *= np.asarray(vectors.scales[indices])[:, None]
+    lengths = norm(block, axis=1, keepdims=True)
+    lengths[lengths == 0] = 1.0
+    return block / lengths
+
+
+def top_indices(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
 
-def search_knowledge(question):
-    query_embedding = model.encode(question)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT title, content, content_embedding FROM knowledge")
-    rows = cursor.fetchall()
-    conn.close()
 
-    best_score = -1
-    best_answer = None
-    threshold = 0.5
+def rows_at(rows, indices):
+    """Строки по позициям: из списка в памяти или одним запросом к SQLite."""
+    if isinstance(rows, StoredRows):
+        return rows.fetch(indices)
+    return [rows[i] for i in indices]
 
-    for title, content, content_embedding in rows:
-        if content_embedding is None:
-            continue
-        content_embedding = np.frombuffer(content_embedding, dtype=np.float32)
-        similarity = cosine_similarity(query_embedding, content_embedding)
-        if similarity > best_score:
-            best_score = similarity
-            best_answer = f"{content[:700]}..."
 
-    return best_answer if best_score > threshold else "Я не нашёл подходящего ответа."
+def top_k_from_scores(scores, rows, k):
+    indices = top_indices(scores, k)
+    return [(float(scores[i]), *row) for i, row in zip(indices, rows_at(rows, indices))]
 
 
-def get_top_context(question, k=3):
-    query_embedding = model.encode(question)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT title, content, content_embedding FROM knowledge")
-    rows = cursor.fetchall()
-    conn.close()
+knowledge_index = KnowledgeIndex()
 
-    scored = []
-    for title, content, embedding in rows:
-        if embedding is None:
-            continue
-        content_embedding = np.frombuffer(embedding, dtype=np.float32)
-        score = cosine_similarity(query_embedding, content_embedding)
-        scored.append((score, title, content))
+_update_listeners = []
 
-    top = sorted(scored, reverse=True)[:k]
-    return "\n\n".join([f"{title}:\n{content}" for _, title, content in top])
 
+def on_knowledge_updated(callback):
+    """Регистрирует функцию, вызываемую после замены базы знаний."""
+    _update_listeners.append(callback)
 
-def is_vke_related(question, threshold=0.4):
-    query_embedding = model.encode(question)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT content_embedding FROM knowledge")
-    rows = cursor.fetchall()
-    conn.close()
 
-    for (embedding,) in rows:
+def _notify_knowledge_updated():
+    for callback in _update_listeners:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Ошибка обработчика обновления базы знаний: {e}")
+
+
+class KnowledgeQuery:
+    """Запрос пользователя в рамках обработки одного сообщения.
+
+    Эмбеддинг и оценки близости считаются один раз и переиспользуются
+    всеми функциями поиска.
+    """
+
+    def __init__(self, text, embedding=None, index=None):
+        self.text = text
         if embedding is None:
-            continue
-        content_embedding = np.frombuffer(embedding, dtype=np.float32)
-        score = cosine_similarity(query_embedding, content_embedding)
-        if score > threshold:
-            return True
-    return False
+            with stage_timer("embedding"):
+                embedding = embedding_model.get().encode(text)
+        self.embedding = embedding
+        index = index or knowledge_index
+        snapshot = index.snapshot()
+        self.vectors = snapshot.vectors
+        self.rows = snapshot.rows
+        lexical_hits = self._lexical_hits(text)
+        positions = [
+            snapshot.positions[row_id]
+            for row_id in lexical_hits
+            if row_id in snapshot.positions
+        ]
+
+        with stage_timer("retrieval_scores"):
+            if (
+                len(self.rows) >= HYBRID_SHORTLIST_MIN_ROWS
+                and len(positions) >= CONTEXT_CANDIDATES
+            ):
+                # Векторы пересчитываются только для лексических кандидатов
+                self.scores = np.full(len(self.rows), -1.0, dtype=np.float32)
+                query = np.asarray(embedding, dtype=np.float32)
+                query = query / (norm(query) or 1.0)
+                self.scores[positions] = row_vectors(self.vectors, positions) @ query
+            else:
+                self.scores, _ = index.scores(embedding, snapshot)
+
+        # Пороги (прямой ответ, тематика, ссылки) откалиброваны по косинусной
+        # близости, поэтому сравниваются с vector_scores; гибридные scores
+        # нужны только для ранжирования контекста.
+        self.vector_scores = self.scores
+        if lexical_hits:
+            self.scores = self.scores.copy()
+        for row_id, score in lexical_hits.items():
+            position = snapshot.positions.get(row_id)
+            if position is not None:
+                self.scores[position] += HYBRID_LEXICAL_WEIGHT * score
+
+    @staticmethod
+    def _lexical_hits(text):
+        if not HYBRID_LEXICAL_WEIGHT:
+            return {}
+        try:
+            with stage_timer("retrieval_lexical"):
+                return lexical.search(DB_PATH, text, HYBRID_CANDIDATES)
+        except Exception as e:
+            logger.warning(f"Лексический поиск недоступен: {e}")
+            return {}
 
+    def top_k(self, k):
+        return top_k_from_scores(self.scores, self.rows, k)
 
-def is_list_request(question):
-    triggers = ["какие", "перечисли", "список", "доступны", "есть ли проекты"]
-    return any(word in question.lower() for word in triggers)
+    def top_indices(self, k):
+        return top_indices(self.scores, k)
+
+    def best_score(self):
+        """Наибольшая косинусная близость, без лексической добавки."""
+        return float(self.vector_scores.max()) if self.vector_scores.size else -1.0
+
+
+def _as_query(question, query):
+    return query if query is not None else KnowledgeQuery(question)
+
+
+@timed("retrieval_search")
+def search_knowledge(
+    question, query=None, threshold=0.5, default="Я не нашёл подходящего ответа."
+):
+    query = _as_query(question, query)
+    top = top_k_from_scores(query.vector_scores, query.rows, 1)
+
+    if top and top[0][0] > threshold:
+        _, _, content, _ = top[0]
+        return f"{content[:700]}..." if len(content) > 700 else content
+    return default
 
 
-def generate_help_link(question, top_k=3, threshold=0.5):
-    query_embedding = model.encode(question)
+_faq_lock = threading.Lock()
+_faq_cache = None
+
+
+def add_faq(question, answer):
+    """Добавляет или заменяет вручную подготовленный ответ на частый вопрос."""
+    global _faq_cache
+    embedding = np.asarray(embedding_model.get().encode(question), dtype=np.float32)
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT title, url, content_embedding FROM knowledge")
-    rows = cursor.fetchall()
+    conn.execute(
+        "REPLACE INTO faq (question, answer, question_embedding) VALUES (?, ?, ?)",
+        (question, answer, embedding.tobytes()),
+    )
+    conn.commit()
     conn.close()
+    with _faq_lock:
+        _faq_cache = None
+
+
+def import_faq(path):
+    """Загружает FAQ из JSONL-файла: {"question": ..., "answer": ...} в строке."""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                add_faq(item["question"], item["answer"])
+                count += 1
+    logger.info(f"Загружено вопросов FAQ: {count}")
+    return count
+
+
+def _load_faq():
+    global _faq_cache
+    with _faq_lock:
+        if _faq_cache is None:
+            conn = sqlite3.connect(DB_PATH)
+            rows = conn.execute(
+                "SELECT answer, question_embedding FROM faq "
+                "WHERE question_embedding IS NOT NULL"
+            ).fetchall()
+            conn.close()
+            answers = [answer for answer, _ in rows]
+            if rows:
+                matrix = np.vstack(
+                    [np.frombuffer(blob, dtype=np.float32) for _, blob in rows]
+                )
+                matrix /= np.maximum(norm(matrix, axis=1, keepdims=True), 1e-12)
+            else:
+                matrix = np.empty((0, 0), dtype=np.float32)
+            _faq_cache = (answers, matrix)
+        return _faq_cache
+
+
+@timed("retrieval_faq")
+def find_faq_answer(question, query=None, threshold=FAQ_MATCH_THRESHOLD):
+    answers, matrix = _load_faq()
+    if not answers:
+        return None
+    query = _as_query(question, query)
+    vector = np.asarray(query.embedding, dtype=np.float32)
+    scores = matrix @ (vector / (norm(vector) or 1.0))
+    best = int(np.argmax(scores))
+    return answers[best] if scores[best] >= threshold else None
+
+
+@timed("retrieval_context")
+def get_top_context(question, k=3, query=None, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Контекст для GigaChat не длиннее token_budget токенов.
+
+    Из CONTEXT_CANDIDATES лучших фрагментов k выбираются по MMR, каждый
+    сокращается до самых релевантных вопросу предложений.
+    """
+    query = _as_query(question, query)
+    indices = query.top_indices(max(k, CONTEXT_CANDIDATES))
+    if not len(indices):
+        return ""
+    candidates = [
+        (float(query.scores[i]), *row)
+        for i, row in zip(indices, rows_at(query.rows, indices))
+    ]
+    context, tokens = assemble_context(
+        query.text,
+        candidates,
+        row_vectors(query.vectors, indices),
+        k,
+        token_budget,
+    )
+    logger.info(f"Контекст: {tokens} токенов из {token_budget}")
+    return context
 
-    relevant_links = []
 
-    for title, url, embedding in rows:
-        if embedding is None or url is None:
-            continue
-        content_embedding = np.frombuffer(embedding, dtype=np.float32)
-        score = cosine_similarity(query_embedding, content_embedding)
+def is_vke_related(question, threshold=0.4, query=None):
+    return _as_query(question, query).best_score() > threshold
 
-        if score >= threshold:
-            relevant_links.append((score, url))
 
-    relevant_links.sort(reverse=True, key=lambda x: x[0])
+def is_list_request(question):
+    triggers = ["какие", "перечисли", "список", "доступны", "есть ли проекты"]
+    return any(word in question.lower() for word in triggers)
 
-    top_links = [url for _, url in relevant_links[:top_k]]
+
+@timed("retrieval_links")
+def generate_help_link(question, top_k=3, threshold=0.5, query=None):
+    query = _as_query(question, query)
+    scores, rows = query.vector_scores, query.rows
+
+    above = np.flatnonzero(scores >= threshold)
+    above = above[np.argsort(-scores[above], kind="stable")]
+    # url читается только для лучших строк; строки без url пропускаются,
+    # поэтому при нехватке берётся следующая порция
+    top_links = []
+    for start in range(0, len(above), top_k):
+        batch = above[start : start + top_k]
+        for _, _, url in rows_at(rows, batch):
+            if url is not None and len(top_links) < top_k:
+                top_links.append(url)
+        if len(top_links) >= top_k:
+            break
 
     if not top_links:
         return SITE_URL
@@ -168,9 +594,7 @@ def generate_help_link(question, top_k=3, threshold=0.5):
     return "\n".join(top_links)
 
 
-def fetch_page_data(url):
-    logger.info(f"Парсинг: {url}")
-    html = get_rendered_html(url)
+def parse_page(html, url):
     soup = BeautifulSoup(html, "html.parser")
     parsed = []
 
@@ -178,64 +602,148 @@ def fetch_page_data(url):
         content = card.get_text(" ", strip=True)
         if content and len(content.split()) >= 5:
             title = content[:40].strip()
-            embedding = model.encode(content).astype(np.float32).tobytes()
-            parsed.append((title, content, url, embedding))
+            parsed.append((title, content, url))
 
     for section in soup.find_all("section"):
         title_tag = section.find(["h2", "h3", "h4"])
         if title_tag:
             title = title_tag.text.strip()
             content = section.get_text(separator=" ", strip=True)
-            embedding = model.encode(content).astype(np.float32).tobytes()
-            parsed.append((title, content, url, embedding))
+            parsed.append((title, content, url))
 
     return parsed
 
 
-def fetch_site_data():
-    html = get_rendered_html(SITE_URL)
-    soup = BeautifulSoup(html, "html.parser")
+@timed("crawl_site")
+def fetch_site_data(start_url=SITE_URL, max_depth=CRAWL_MAX_DEPTH):
     parsed_data = []
+    for url, html in crawl_site(start_url, max_depth=max_depth):
+        parsed_data.extend(parse_page(html, url))
+    return parsed_data
 
-    internal_links = set()
-    for link in soup.find_all("a", href=True):
-        href = link["href"].strip()
-        full_url = urljoin(SITE_URL, href)
-        clean_url = full_url.split("#")[0]
-        if clean_url.startswith(SITE_URL):
-            internal_links.add(clean_url)
 
-    internal_links.discard(SITE_URL)
-    parsed_data.extend(fetch_page_data(SITE_URL))
+def content_hash(title, content, url):
+    return hashlib.sha1(f"{url}\n{title}\n{content}".encode("utf-8")).hexdigest()
 
-    for link in internal_links:
-        try:
-            parsed_data.extend(fetch_page_data(link))
-        except Exception as e:
-            logger.warning(f"Ошибка парсинга {link}: {e}")
 
-    return parsed_data
+def get_stored_embeddings():
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT content_hash, content_embedding FROM knowledge "
+        "WHERE content_hash IS NOT NULL AND content_embedding IS NOT NULL"
+    )
+    stored = dict(cursor.fetchall())
+    conn.close()
+    return stored
+
+
+@timed("crawl_embedding")
+def encode_batched(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Кодирует тексты пачками, отсортированными по длине (меньше паддинга)."""
+    vectors = [None] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    start = time.time()
+    for offset in range(0, len(order), batch_size):
+        batch = order[offset : offset + batch_size]
+        encoded = embedding_model.get().encode(
+            [texts[i] for i in batch],
+            batch_size=batch_size,
+            show_progress_bar=False,
+        )
+        for i, vector in zip(batch, encoded):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+        done = offset + len(batch)
+        elapsed = time.time() - start
+        logger.info(
+            f"Эмбеддинги: {done}/{len(texts)} блоков, "
+            f"{done / elapsed if elapsed else 0:.1f} блоков/с"
+        )
+    return vectors
+
+
+def embed_sections(sections):
+    """Добавляет эмбеддинги к (title, content, url).
+
+    Для разделов, текст которых не изменился с прошлого обновления,
+    используется сохранённый эмбеддинг; кодируются только новые.
+    """
+    stored = get_stored_embeddings()
+    result = []
+    pending = []
+    for title, content, url in sections:
+        embedding = stored.get(content_hash(title, content, url))
+        if embedding is None:
+            pending.append(len(result))
+        result.append([title, content, url, embedding])
+
+    if pending:
+        vectors = encode_batched([result[i][1] for i in pending])
+        for i, vector in zip(pending, vectors):
+            result[i][3] = vector.tobytes()
+
+    logger.info(
+        f"Эмбеддинги: переиспользовано {len(result) - len(pending)}, "
+        f"вычислено {len(pending)}."
+    )
+    return [tuple(row) for row in result]
 
 
 def save_to_db(data):
+    """Синхронизирует таблицу knowledge с data по хэшу содержимого.
+
+    Неизменённые записи остаются на месте, удалённые удаляются точечно,
+    новые и изменённые добавляются. Все изменения, включая отметку
+    last_updated, применяются одной транзакцией, после чего
+    подменяется индекс в памяти.
+    """
+    now = datetime.now()
+    incoming = {}
+    for title, content, url, embedding in data:
+        incoming.setdefault(
+            content_hash(title, content, url), (title, content, url, embedding)
+        )
+
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM knowledge")
-    now = datetime.now()
-    cursor.executemany(
-        """
-        INSERT INTO knowledge (title, content, url, content_embedding, last_updated)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        [
-            (title, content, url, embedding, now)
-            for title, content, url, embedding in data
-        ],
+    cursor.execute("SELECT id, content_hash FROM knowledge")
+    existing = {}
+    stale_ids = []
+    for row_id, row_hash in cursor.fetchall():
+        if row_hash in incoming and row_hash not in existing:
+            existing[row_hash] = row_id
+        else:
+            stale_ids.append((row_id,))
+
+    cursor.executemany("DELETE FROM knowledge WHERE id = ?", stale_ids)
+    lexical.remove_rows(cursor, stale_ids)
+    inserted = []
+    for row_hash, (title, content, url, embedding) in incoming.items():
+        if row_hash in existing:
+            continue
+        cursor.execute(
+            """
+            INSERT INTO knowledge (title, content, url, content_embedding, last_updated, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (title, content, url, embedding, now, row_hash),
+        )
+        inserted.append((cursor.lastrowid, title, content))
+    lexical.index_rows(cursor, inserted)
+
+    cursor.execute(
+        "REPLACE INTO meta (key, value) VALUES (?, ?)",
+        ("last_updated", now.isoformat()),
     )
 
     conn.commit()
     conn.close()
-    set_meta_value("last_updated", now.isoformat())
+    logger.info(
+        f"База знаний обновлена: без изменений {len(existing)}, "
+        f"удалено {len(stale_ids)}, добавлено {len(incoming) - len(existing)}."
+    )
+    knowledge_index.load()
+    _notify_knowledge_updated()
 
 
 def set_meta_value(key, value):
@@ -255,17 +763,83 @@ def get_meta_value(key):
     return result[0] if result else None
 
 
+_refresh_lock = threading.Lock()
+
+
+def count_knowledge_rows():
+    conn = sqlite3.connect(DB_PATH)
+    count = conn.execute("SELECT COUNT(*) FROM knowledge").fetchone()[0]
+    conn.close()
+    return count
+
+
 def update_if_needed():
-    last_updated = get_meta_value("last_updated")
-    now = datetime.now()
-    if not last_updated or (now - datetime.fromisoformat(last_updated)) > timedelta(
-        days=4
-    ):
-        logger.debug("Обновление базы знаний с сайта...")
-        data = fetch_site_data()
-        save_to_db(data)
-    else:
-        logger.debug("Обновление не требуется.")
+    if not _refresh_lock.acquire(blocking=False):
+        logger.debug("Обновление базы знаний уже выполняется.")
+        return
+    try:
+        last_updated = get_meta_value("last_updated")
+        now = datetime.now()
+        if not last_updated or (now - datetime.fromisoformat(last_updated)) > timedelta(
+            days=KNOWLEDGE_REFRESH_DAYS
+        ):
+            logger.debug("Обновление базы знаний с сайта...")
+            with stage_timer("knowledge_refresh"):
+                sections = normalize_sections(fetch_site_data())
+                stored = count_knowledge_rows()
+                if len(sections) < stored * KNOWLEDGE_REFRESH_MIN_RATIO or not sections:
+                    logger.error(
+                        f"С сайта получено {len(sections)} разделов при {stored} "
+                        "сохранённых — обновление пропущено, база не изменена."
+                    )
+                    return
+                save_to_db(embed_sections(sections))
+        else:
+            logger.debug("Обновление не требуется.")
+    finally:
+        _refresh_lock.release()
+
+
+def start_background_refresh(interval=KNOWLEDGE_REFRESH_CHECK_INTERVAL):
+    """Периодически вызывает update_if_needed в фоновом потоке.
+
+    Пока идёт обновление, бот отвечает по предыдущему снимку базы.
+    Возвращает Event, установка которого останавливает поток.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            try:
+                update_if_needed()
+            except Exception as e:
+                logger.error(f"Ошибка фонового обновления базы знаний: {e}")
+            stop.wait(interval)
+
+    threading.Thread(target=loop, name="knowledge-refresh", daemon=True).start()
+    return stop
+
+
+def start_store_watcher(interval=KNOWLEDGE_WATCH_INTERVAL):
+    """Для процессов, которые сами базу не обновляют.
+
+    Следит за версией векторного хранилища и перечитывает индекс, когда
+    главный процесс запишет новый снимок. Возвращает Event остановки.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                version = read_version(knowledge_index.store_path)
+                if version and version != knowledge_index.version:
+                    knowledge_index.load()
+                    _notify_knowledge_updated()
+            except Exception as e:
+                logger.error(f"Ошибка перечитывания векторного хранилища: {e}")
+
+    threading.Thread(target=loop, name="knowledge-watch", daemon=True).start()
+    return stop
 
 
 def list_projects_for_audience(audience_keyword="студент"):
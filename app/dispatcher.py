@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MessageDispatcher:
+    """Пул воркеров для обработки входящих сообщений.
+
+    Сообщения одного пользователя всегда попадают в одну и ту же очередь,
+    поэтому обрабатываются строго по порядку. Очереди ограничены: при
+    переполнении submit блокируется, пока воркер не освободит место.
+
+    Вместе с сообщением хранится момент его приёма (time.monotonic): handler
+    вызывается как handler(item, received_at), чтобы ожидание в очереди
+    входило в бюджет времени на ответ.
+    """
+
+    def __init__(self, handler, workers=8, queue_size=100):
+        self.handler = handler
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._worker, args=(q,), name=f"vkbot-worker-{i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        self._started = True
+        logger.info(f"Запущено воркеров: {len(self.threads)}")
+
+    def submit(self, key, item, timeout=None, received_at=None):
+        """received_at — если событие принято раньше, например главным
+        процессом; CLOCK_MONOTONIC общий для процессов одного хоста."""
+        received_at = time.monotonic() if received_at is None else received_at
+        q = self.queues[hash(key) % len(self.queues)]
+        if q.full():
+            logger.warning(f"Очередь воркера переполнена, ожидание места для {key}")
+        q.put((item, received_at), timeout=timeout)
+
+    def try_submit(self, key, item):
+        """Неблокирующий вариант submit: возвращает False, если очередь полна."""
+        try:
+            self.queues[hash(key) % len(self.queues)].put_nowait(
+                (item, time.monotonic())
+            )
+            return True
+        except queue.Full:
+            return False
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def shutdown(self, timeout=None):
+        """Останавливает воркеры, дожидаясь обработки уже принятых сообщений."""
+        if not self._started:
+            return
+        logger.info("Остановка воркеров...")
+        for q in self.queues:
+            q.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        self._started = False
+        logger.info("Воркеры остановлены.")
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(*item)
+            except Exception as e:
+                logger.error(f"Ошибка в воркере: {e}")
+            finally:
+                q.task_done()
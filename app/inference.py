@@ -0,0 +1,268 @@
+"""Процесс инференса: эмбеддинги и токсичность по локальному IPC.
+
+Модели загружаются один раз в каждом процессе инференса. Обработчики
+подключаются к нему через multiprocessing.connection (unix-сокет с
+authkey) и получают вместо моделей клиентов RemoteEmbedding и
+RemoteToxicity с тем же интерфейсом (encode и score).
+
+Запросы эмбеддингов от разных обработчиков, пришедшие в пределах
+INFERENCE_BATCH_WAIT_MS, кодируются одним батчем; токсичность батчит
+ToxicityClassifier.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from config import INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT_MS, INFERENCE_TIMEOUT
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Склеивает списки текстов из разных запросов в один вызов encode."""
+
+    def __init__(self, model, max_batch_size=INFERENCE_BATCH_SIZE, max_wait=0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = queue.Queue()
+        threading.Thread(
+            target=self._loop, name="embedding-batcher", daemon=True
+        ).start()
+
+    def submit(self, texts):
+        future = Future()
+        self._pending.put((texts, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._pending.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                vectors = np.asarray(
+                    self.model.encode(
+                        texts, batch_size=self.max_batch_size, show_progress_bar=False
+                    ),
+                    dtype=np.float32,
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            logger.debug(f"Батч эмбеддингов: {len(batch)} запросов, {size} текстов")
+            offset = 0
+            for item_texts, future in batch:
+                future.set_result(vectors[offset : offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+class InferenceServer:
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+
+    def load(self):
+        """Загружает модели до того, как сервер начнёт принимать подключения."""
+        from db import embedding_model
+        from text_utils import toxicity
+        from models import startup_report, warm_up
+
+        warm_up(["embedding", "toxicity"]).shutdown(wait=True)
+        logger.info(startup_report())
+        self.embedding = EmbeddingBatcher(
+            embedding_model.get(), max_wait=INFERENCE_BATCH_WAIT_MS / 1000
+        )
+        self.toxicity = toxicity.get()
+
+    def serve_forever(self, ready=None):
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"Процесс инференса слушает {self.address}")
+        if ready is not None:
+            ready.set()
+        while True:
+            conn = listener.accept()
+            threading.Thread(
+                target=self._serve_connection, args=(conn,), daemon=True
+            ).start()
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(request_id, future):
+            try:
+                message = (request_id, True, future.result())
+            except Exception as e:
+                message = (request_id, False, repr(e))
+            with send_lock:
+                conn.send(message)
+
+        while True:
+            try:
+                request_id, kind, payload = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                return
+            if kind == "encode":
+                future = self.embedding.submit(payload)
+            elif kind == "toxicity":
+                future = self.toxicity.submit(payload)
+            else:
+                future = Future()
+                future.set_exception(ValueError(f"неизвестный запрос {kind}"))
+            future.add_done_callback(
+                lambda done, request_id=request_id: reply(request_id, done)
+            )
+
+
+def serve(address, authkey, ready=None):
+    """Точка входа процесса инференса."""
+    server = InferenceServer(address, authkey)
+    server.load()
+    server.serve_forever(ready)
+
+
+class InferenceClient:
+    """Одно соединение с процессом инференса на весь процесс-обработчик.
+
+    Вызовы из разных потоков мультиплексируются по request_id. Ответ
+    ждётся не дольше timeout секунд; после обрыва связи (например, пока
+    главный процесс перезапускает упавший процесс инференса) следующий
+    вызов пытается подключиться заново.
+    """
+
+    def __init__(self, address, authkey, timeout=INFERENCE_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._futures = {}
+        self.conn = None
+        self._connect()
+
+    @property
+    def closed(self):
+        return self.conn is None
+
+    def _connect(self):
+        conn = Client(self.address, authkey=self.authkey)
+        self.conn = conn
+        threading.Thread(
+            target=self._read_loop, args=(conn,), name="inference-client", daemon=True
+        ).start()
+
+    def call(self, kind, payload):
+        with self._lock:
+            if self.conn is None:
+                try:
+                    self._connect()
+                except OSError as e:
+                    raise ConnectionError(f"процесс инференса недоступен: {e}")
+            conn = self.conn
+            request_id = next(self._ids)
+            future = Future()
+            self._futures[request_id] = future
+        try:
+            try:
+                with self._send_lock:
+                    conn.send((request_id, kind, payload))
+            except OSError as e:
+                with self._lock:
+                    if self.conn is conn:
+                        self.conn = None
+                raise ConnectionError(f"процесс инференса недоступен: {e}")
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            counter(
+                "vkbot_inference_timeouts_total", "Таймауты запросов к инференсу"
+            ).inc()
+            raise TimeoutError(f"инференс не ответил за {self.timeout:.1f} с")
+        finally:
+            with self._lock:
+                self._futures.pop(request_id, None)
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                request_id, ok, result = conn.recv()
+            except (EOFError, OSError) as e:
+                counter(
+                    "vkbot_inference_disconnects_total", "Обрывы связи с инференсом"
+                ).inc()
+                logger.error(f"Связь с процессом инференса потеряна: {e}")
+                with self._lock:
+                    if self.conn is conn:
+                        self.conn = None
+                    pending = list(self._futures.values())
+                    self._futures.clear()
+                for future in pending:
+                    if not future.done():
+                        future.set_exception(
+                            ConnectionError("процесс инференса недоступен")
+                        )
+                return
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            # ответ на уже брошенный по таймауту запрос
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+
+class RemoteEmbedding:
+    """Заменяет SentenceTransformer: encode одного текста или списка."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.client.call("encode", [texts])[0]
+        return self.client.call("encode", list(texts))
+
+
+class RemoteToxicity:
+    """Заменяет ToxicityClassifier для contains_profanity."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def score(self, text):
+        return self.client.call("toxicity", text)
+
+
+def use_inference_worker(address, authkey):
+    """Переключает ленивые модели текущего процесса на процесс инференса."""
+    from models import use_loader
+
+    client = InferenceClient(address, authkey)
+    use_loader("embedding", lambda: RemoteEmbedding(client))
+    use_loader("toxicity", lambda: RemoteToxicity(client))
+    return client
@@ -0,0 +1,88 @@
+import logging
+import re
+import sqlite3
+from functools import lru_cache
+
+from nltk.stem.snowball import SnowballStemmer
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+_stemmer = SnowballStemmer("russian")
+
+FTS_TABLE = "knowledge_fts"
+# raw / (raw + BM25_SATURATION): сильные совпадения стремятся к 1, слабые — к 0
+BM25_SATURATION = 2.0
+
+STOP_WORDS = frozenset(
+    "и в во не что он на я с со как а то все она так его но да ты к у же вы за бы "
+    "по только ее мне было вот от меня еще нет о из ему теперь когда даже ну ли "
+    "если уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя "
+    "ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб "
+    "без будто чего раз тоже себе под будет тогда кто этот того потому этого какой "
+    "ним здесь этом один почти мой тем чтобы нее были куда зачем всех можно при "
+    "об другой хоть после над больше тот через эти нас про всего них какая много "
+    "разве три эту моя свою этой перед иногда лучше чуть том нельзя такой им более "
+    "всегда конечно всю между какие".split()
+)
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    return _stemmer.stem(word)
+
+
+def stems(text):
+    """Основы слов текста (Snowball для русского; латиница остаётся как есть)."""
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+
+def create_table(cursor):
+    cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(stems)")
+
+
+def index_rows(cursor, rows):
+    """Добавляет в индекс строки [(id, title, content)]."""
+    cursor.executemany(
+        f"INSERT INTO {FTS_TABLE} (rowid, stems) VALUES (?, ?)",
+        [
+            (row_id, " ".join(stems(f"{title} {content}")))
+            for row_id, title, content in rows
+        ],
+    )
+
+
+def remove_rows(cursor, row_ids):
+    cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", row_ids)
+
+
+def rebuild(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    cursor.execute("SELECT id, title, content FROM knowledge")
+    index_rows(cursor, cursor.fetchall())
+    conn.commit()
+    logger.info("Лексический индекс перестроен.")
+
+
+def search(db_path, text, limit):
+    """BM25-поиск: {id строки knowledge: оценка}, оценка нормирована в [0, 1)."""
+    terms = sorted(set(stems(text)))
+    if not terms:
+        return {}
+    match = " OR ".join('"' + term.replace('"', "") + '"' for term in terms)
+    conn = sqlite3.connect(db_path)
+    try:
+        hits = conn.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH ? ORDER BY bm25({FTS_TABLE}) LIMIT ?",
+            (match, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    # bm25() в SQLite отрицателен: чем меньше, тем релевантнее
+    return {
+        row_id: max(-score, 0.0) / (max(-score, 0.0) + BM25_SATURATION)
+        for row_id, score in hits
+    }
@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = "vkbot_stage_duration_seconds"
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_help = {}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    """Гистограмма с бакетами Prometheus и окном последних значений для перцентилей."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, window=2048):
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self._recent.append(value)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    self.bucket_counts[i] += 1
+
+    def percentiles(self, points=(50, 95, 99)):
+        with self._lock:
+            recent = np.array(self._recent, dtype=np.float64)
+        if not recent.size:
+            return {}
+        return {f"p{p}": float(np.percentile(recent, p)) for p in points}
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+def histogram(name, help_text="", **labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+            _help.setdefault(name, help_text)
+        return _histograms[key]
+
+
+def counter(name, help_text="", **labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        if key not in _counters:
+            _counters[key] = Counter()
+            _help.setdefault(name, help_text)
+        return _counters[key]
+
+
+def gauge(name, func, help_text="", **labels):
+    """Регистрирует показатель, значение которого вычисляет func при выгрузке."""
+    with _lock:
+        _gauges[(name, _label_key(labels))] = func
+        _help.setdefault(name, help_text)
+
+
+@contextmanager
+def stage_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram(STAGE_SECONDS, "Длительность этапа обработки", stage=stage).observe(
+            time.perf_counter() - start
+        )
+
+
+def timed(stage):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items(), key=lambda item: item[0])
+
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# HELP {name} {_help.get(name) or name}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, key), hist in histograms:
+        declare(name, "histogram")
+        with hist._lock:
+            counts, total, count = list(hist.bucket_counts), hist.sum, hist.count
+        for bound, bucket in zip(hist.BUCKETS, counts):
+            lines.append(
+                f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket}"
+            )
+        lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(key)} {total}")
+        lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+    for (name, key), value in counters:
+        declare(name, "counter")
+        lines.append(f"{name}{_format_labels(key)} {value.value}")
+
+    for (name, key), func in gauges:
+        try:
+            value = float(func())
+        except Exception as e:
+            logger.debug(f"Не удалось вычислить {name}: {e}")
+            continue
+        declare(name, "gauge")
+        lines.append(f"{name}{_format_labels(key)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def summary_line():
+    with _lock:
+        stages = [
+            (dict(key).get("stage"), hist)
+            for (name, key), hist in sorted(_histograms.items())
+            if name == STAGE_SECONDS
+        ]
+        gauges = sorted(_gauges.items(), key=lambda item: item[0])
+    parts = []
+    for stage, hist in stages:
+        p = hist.percentiles()
+        if p:
+            parts.append(
+                f"{stage}: n={hist.count} p50={p['p50'] * 1000:.0f}мс "
+                f"p95={p['p95'] * 1000:.0f}мс p99={p['p99'] * 1000:.0f}мс"
+            )
+    for (name, key), func in gauges:
+        try:
+            parts.append(f"{name}{_format_labels(key)}={float(func()):.2f}")
+        except Exception:
+            continue
+    return "; ".join(parts)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+def start_summary_logger(interval):
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            line = summary_line()
+            if line:
+                logger.info(f"Метрики: {line}")
+
+    threading.Thread(target=loop, name="metrics-summary", daemon=True).start()
+    return stop
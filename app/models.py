@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import MODELS_OFFLINE
+
+if MODELS_OFFLINE:
+    # Загружаем модели только из MODEL_CACHE_DIR, без обращений к сети
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class LazyModel:
+    """Потокобезопасная отложенная загрузка модели при первом обращении."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+        self.load_time = None
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    value = self._loader()
+                    self.load_time = time.perf_counter() - start
+                    self._value = value
+                    logger.info(
+                        f"Модель {self.name} загружена за {self.load_time:.2f} секунд."
+                    )
+        return self._value
+
+
+def lazy_model(name, loader):
+    model = LazyModel(name, loader)
+    _registry[name] = model
+    return model
+
+
+def use_loader(name, loader):
+    """Подменяет загрузчик модели, пока она ещё не загружена.
+
+    Так процессы-обработчики получают вместо модели клиент процесса
+    инференса.
+    """
+    model = _registry[name]
+    with model._lock:
+        if model._value is not None:
+            raise RuntimeError(f"модель {name} уже загружена")
+        model._loader = loader
+
+
+def warm_up(names=None):
+    """Загружает модели параллельно в фоне.
+
+    Возвращает executor; его shutdown(wait=True) дожидается окончания
+    загрузки, а ошибки загрузки только логируются — модель будет загружена
+    повторно при первом обращении.
+    """
+    models = [_registry[name] for name in (names or _registry)]
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, len(models)), thread_name_prefix="warm-up"
+    )
+
+    def load(model):
+        try:
+            model.get()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки модели {model.name}: {e}")
+
+    for model in models:
+        executor.submit(load, model)
+    return executor
+
+
+def startup_report():
+    lines = []
+    for name, model in _registry.items():
+        status = f"{model.load_time:.2f} с" if model.loaded else "не загружена"
+        lines.append(f"  {name}: {status}")
+    return "Загрузка моделей:\n" + "\n".join(lines)
@@ -0,0 +1,298 @@
+"""Многопроцессный режим: HANDLER_PROCESSES обработчиков и пул инференса.
+
+Главный процесс получает события longpoll, обновляет базу знаний и
+раскладывает сообщения по очередям обработчиков по from_id, так что
+сообщения одного пользователя обрабатываются по порядку одним
+процессом. Процессы инференса (INFERENCE_WORKERS) загружают эмбеддинги
+и классификатор токсичности один раз и обслуживают обработчиков по
+unix-сокетам. Индекс знаний все процессы читают из одного векторного
+хранилища, отображённого в память.
+
+Запуск: HANDLER_PROCESSES=4 python app.py
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import time
+
+from config import (
+    HANDLER_PROCESSES,
+    HANDLER_SUBMIT_TIMEOUT,
+    INFERENCE_WORKERS,
+    METRICS_LOG_INTERVAL,
+    METRICS_PORT,
+    SUPERVISOR_INTERVAL,
+    VECTOR_STORE_DTYPE,
+    VK_RATE_LIMIT,
+    WORKER_QUEUE_SIZE,
+)
+from metrics import counter, gauge, start_metrics_server, start_summary_logger
+
+logger = logging.getLogger(__name__)
+
+_STOP = None
+
+
+class QueuedEvent:
+    """Событие, переданное обработчику: только то, что читает handle_message."""
+
+    def __init__(self, obj, received_at=None):
+        self.object = obj
+        self.received_at = received_at
+
+
+def _inference_main(address, authkey, ready):
+    import inference
+
+    logging.basicConfig(level=logging.INFO)
+    inference.serve(address, authkey, ready)
+
+
+def _handler_main(index, events, address, authkey, store_dtype, vk_rate):
+    import db
+    import inference
+
+    logging.basicConfig(level=logging.INFO)
+    inference.use_inference_worker(address, authkey)
+    db.knowledge_index.store_dtype = store_dtype
+
+    from app import VkBot
+
+    bot = VkBot(
+        use_longpoll=False,
+        primary=False,
+        metrics_port=METRICS_PORT + 1 + index if METRICS_PORT else 0,
+        vk_rate=vk_rate,
+    )
+    bot.dispatcher.start()
+    logger.info(f"Обработчик {index} (pid {os.getpid()}) готов.")
+    try:
+        while True:
+            event = events.get()
+            if event is _STOP:
+                break
+            bot.dispatcher.submit(
+                event.object["from_id"], event, received_at=event.received_at
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bot.refresh_stop.set()
+        bot.dispatcher.shutdown()
+
+
+class ProcessGroup:
+    """Процессы инференса и обработчики под присмотром главного процесса.
+
+    Фоновый поток раз в SUPERVISOR_INTERVAL секунд проверяет детей и
+    перезапускает упавших: обработчик получает новую очередь (очередь,
+    читатель которой умер, может остаться заблокированной), процесс
+    инференса — тот же адрес, к которому клиенты переподключатся сами.
+    """
+
+    def __init__(self, handlers=HANDLER_PROCESSES, inference_workers=INFERENCE_WORKERS):
+        # spawn: дочерние процессы не наследуют потоки и блокировки родителя
+        self.context = multiprocessing.get_context("spawn")
+        self.handlers = max(1, handlers)
+        self.inference_workers = max(1, inference_workers)
+        self.authkey = secrets.token_bytes(16)
+        self.socket_dir = tempfile.mkdtemp(prefix="vkbot-")
+        self.addresses = [
+            os.path.join(self.socket_dir, f"inference-{i}.sock")
+            for i in range(self.inference_workers)
+        ]
+        self.inference = [None] * self.inference_workers
+        self.handler_processes = []
+        self.queues = []
+        self.store_dtype = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _spawn_inference(self, i):
+        address = self.addresses[i]
+        # сокет упавшего процесса остаётся на диске и мешает bind
+        if os.path.exists(address):
+            os.remove(address)
+        ready = self.context.Event()
+        process = self.context.Process(
+            target=_inference_main,
+            args=(address, self.authkey, ready),
+            name=f"vkbot-inference-{i}",
+            daemon=True,
+        )
+        process.start()
+        self.inference[i] = process
+        return process, ready
+
+    def start_inference(self):
+        """Запускает процессы инференса и ждёт, пока каждый загрузит модели."""
+        started = [self._spawn_inference(i) for i in range(self.inference_workers)]
+        for process, ready in started:
+            while not ready.wait(1):
+                if not process.is_alive():
+                    raise RuntimeError(f"{process.name} завершился при загрузке")
+        logger.info(f"Процессы инференса готовы: {len(started)}")
+
+    def _spawn_handler(self, i):
+        # лимит VK общий для группы — делим его между обработчиками
+        vk_rate = VK_RATE_LIMIT / self.handlers
+        events = self.context.Queue(maxsize=WORKER_QUEUE_SIZE)
+        process = self.context.Process(
+            target=_handler_main,
+            args=(
+                i,
+                events,
+                self.addresses[i % len(self.addresses)],
+                self.authkey,
+                self.store_dtype,
+                vk_rate,
+            ),
+            name=f"vkbot-handler-{i}",
+        )
+        process.start()
+        return process, events
+
+    def start_handlers(self, store_dtype):
+        self.store_dtype = store_dtype
+        for i in range(self.handlers):
+            process, events = self._spawn_handler(i)
+            self.handler_processes.append(process)
+            self.queues.append(events)
+        logger.info(f"Запущено процессов-обработчиков: {self.handlers}")
+        threading.Thread(
+            target=self._supervise, name="process-supervisor", daemon=True
+        ).start()
+
+    def _supervise(self):
+        while not self._stop.wait(SUPERVISOR_INTERVAL):
+            for i, process in enumerate(self.inference):
+                if (
+                    process is not None
+                    and not process.is_alive()
+                    and not self._stop.is_set()
+                ):
+                    logger.error(
+                        f"{process.name} завершился (код {process.exitcode}), перезапуск"
+                    )
+                    counter(
+                        "vkbot_process_restarts_total",
+                        "Перезапуски дочерних процессов",
+                        role="inference",
+                    ).inc()
+                    self._spawn_inference(i)
+            for i, process in enumerate(self.handler_processes):
+                if not process.is_alive() and not self._stop.is_set():
+                    logger.error(
+                        f"{process.name} завершился (код {process.exitcode}), "
+                        "перезапуск; сообщения из его очереди потеряны"
+                    )
+                    counter(
+                        "vkbot_process_restarts_total",
+                        "Перезапуски дочерних процессов",
+                        role="handler",
+                    ).inc()
+                    replacement, events = self._spawn_handler(i)
+                    with self._lock:
+                        self.handler_processes[i] = replacement
+                        self.queues[i] = events
+
+    def queue_depth(self, i):
+        with self._lock:
+            events = self.queues[i]
+        return events.qsize()
+
+    def register_metrics(self):
+        for i in range(self.handlers):
+            gauge(
+                "vkbot_handler_queue_depth",
+                lambda i=i: self.queue_depth(i),
+                "События в очереди процесса-обработчика",
+                handler=str(i),
+            )
+
+    def submit(self, key, event, timeout=HANDLER_SUBMIT_TIMEOUT):
+        """Передаёт событие обработчику; False, если его очередь так и не
+        освободилась — longpoll не должен вставать из-за одного процесса."""
+        if event.received_at is None:
+            event.received_at = time.monotonic()
+        with self._lock:
+            events = self.queues[hash(key) % len(self.queues)]
+        try:
+            events.put(event, timeout=timeout)
+            return True
+        except queue.Full:
+            counter(
+                "vkbot_dropped_events_total", "События, не принятые обработчиком"
+            ).inc()
+            logger.error(f"Очередь обработчика переполнена, событие от {key} отброшено")
+            return False
+
+    def shutdown(self, timeout=30):
+        self._stop.set()
+        for events in self.queues:
+            try:
+                events.put(_STOP, timeout=1)
+            except queue.Full:
+                pass
+        for process in self.handler_processes:
+            process.join(timeout)
+        for process in self.handler_processes + self.inference:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for address in self.addresses:
+            if os.path.exists(address):
+                os.remove(address)
+        os.rmdir(self.socket_dir)
+
+
+def run(handlers=HANDLER_PROCESSES, inference_workers=INFERENCE_WORKERS):
+    import vk_api
+    from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
+
+    import db
+    import inference
+    from config import FAQ_PATH, VK_API_TOKEN, VK_GROUP_ID
+
+    group = ProcessGroup(handlers, inference_workers)
+    group.start_inference()
+
+    # главному процессу модели нужны только для обновления базы и FAQ
+    inference.use_inference_worker(group.addresses[0], group.authkey)
+    store_dtype = VECTOR_STORE_DTYPE or "float32"
+    db.knowledge_index.store_dtype = store_dtype
+    db.init_db()
+    db.import_faq(FAQ_PATH)
+    db.knowledge_index.load()
+    refresh_stop = db.start_background_refresh()
+
+    group.start_handlers(store_dtype)
+    # обработчики публикуют метрики на METRICS_PORT + 1 + i, главный процесс —
+    # свои: перезапуски, отброшенные события, обновление базы, очереди
+    group.register_metrics()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    if METRICS_LOG_INTERVAL:
+        start_summary_logger(METRICS_LOG_INTERVAL)
+
+    vk_session = vk_api.VkApi(token=VK_API_TOKEN)
+    longpoll = VkBotLongPoll(vk_session, group_id=VK_GROUP_ID)
+    logger.info("Бот запущен в многопроцессном режиме и слушает сообщения...")
+    try:
+        for event in longpoll.listen():
+            if event.type == VkBotEventType.MESSAGE_NEW:
+                group.submit(event.object["from_id"], QueuedEvent(dict(event.object)))
+    except KeyboardInterrupt:
+        logger.info("Получен сигнал остановки.")
+    finally:
+        refresh_stop.set()
+        group.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run()
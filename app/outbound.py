@@ -0,0 +1,149 @@
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from config import VK_EXECUTE_BATCH, VK_RATE_LIMIT, VK_SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Too many requests per second, flood control, rate limit reached
+RATE_LIMIT_CODES = {6, 9, 29}
+MAX_EXECUTE_CODE_SIZE = 60000
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Неблокирующий вариант acquire: False, если токенов нет."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def idle(self):
+        """Ведро полное — состояние пользователя можно забыть."""
+        with self._lock:
+            self._refill()
+            return self.tokens >= self.capacity
+
+
+class OutboundSender:
+    """Очередь исходящих вызовов VK API с учётом лимитов группы.
+
+    Вызовы выполняются одним потоком строго по порядку постановки, так что
+    сообщения каждому пользователю приходят в том же порядке. При
+    накоплении очереди несколько вызовов объединяются в один execute.
+    """
+
+    def __init__(
+        self,
+        session,
+        rate=VK_RATE_LIMIT,
+        batch_size=VK_EXECUTE_BATCH,
+        retries=VK_SEND_RETRIES,
+        use_execute=True,
+    ):
+        self.session = session
+        self.bucket = TokenBucket(rate)
+        self.batch_size = batch_size if use_execute else 1
+        self.retries = retries
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._loop, name="vk-outbound", daemon=True
+        )
+        self._thread.start()
+
+    def call(self, method, params):
+        """Ставит вызов в очередь; результат API придёт в возвращённый Future."""
+        future = Future()
+        self._queue.put((method, params, future))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        size = 0
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(json.dumps(item[1], ensure_ascii=False))
+            if size > MAX_EXECUTE_CODE_SIZE // 2:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self._with_retries(batch)
+            except Exception as e:
+                logger.error(f"Не удалось выполнить {len(batch)} вызовов VK API: {e}")
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (method, params, future), result in zip(batch, results):
+                if result is False:
+                    # Ошибка отдельного вызова внутри execute — повторяем его отдельно
+                    try:
+                        result = self._with_retries([(method, params, future)])[0]
+                    except Exception as e:
+                        future.set_exception(e)
+                        continue
+                future.set_result(result)
+
+    def _with_retries(self, batch):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return self._execute(batch)
+            except Exception as e:
+                code = getattr(e, "code", None)
+                if code not in RATE_LIMIT_CODES or attempt == self.retries:
+                    raise
+                delay = min(30, 0.5 * 2**attempt) + random.uniform(0, 0.5)
+                logger.warning(f"Лимит VK API (код {code}), повтор через {delay:.1f} с")
+                time.sleep(delay)
+
+    def _execute(self, batch):
+        if len(batch) == 1:
+            method, params, _ = batch[0]
+            return [self.session.method(method, params)]
+        calls = ",".join(
+            f"API.{method}({json.dumps(params, ensure_ascii=False)})"
+            for method, params, _ in batch
+        )
+        response = self.session.method("execute", {"code": f"return [{calls}];"})
+        logger.debug(f"Выполнено {len(batch)} вызовов одним execute")
+        return response
@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+from config import (
+    DEADLINE_BUDGETS,
+    GIGACHAT_BREAKER_FAILURES,
+    GIGACHAT_BREAKER_RECOVERY,
+    MESSAGE_DEADLINE,
+)
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_budgets(spec):
+    """ "spelling=1,llm=15" -> {"spelling": 1.0, "llm": 15.0} в порядке этапов."""
+    budgets = {}
+    for part in spec.split(","):
+        if part.strip():
+            stage, seconds = part.split("=")
+            budgets[stage.strip()] = float(seconds)
+    return budgets
+
+
+class Deadline:
+    """Сквозной бюджет времени на одно сообщение.
+
+    Этап получает свою долю, но не больше остатка за вычетом долей
+    следующих за ним этапов: если начало обработки затянулось, сжимается
+    запрос к GigaChat, а не отправка ответа.
+    """
+
+    def __init__(self, total=MESSAGE_DEADLINE, budgets=None, started=None):
+        # started — момент приёма сообщения (time.monotonic): ожидание в
+        # очередях тоже расходует бюджет
+        self.started = time.monotonic() if started is None else started
+        self.expires_at = self.started + total
+        budgets = budgets if budgets is not None else parse_budgets(DEADLINE_BUDGETS)
+        # доли, не помещающиеся в общий бюджет, сжимаются пропорционально
+        scale = min(1.0, total / (sum(budgets.values()) or 1.0))
+        self.budgets = {stage: share * scale for stage, share in budgets.items()}
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() == 0.0
+
+    def budget(self, stage):
+        stages = list(self.budgets)
+        later = (
+            sum(self.budgets[s] for s in stages[stages.index(stage) + 1 :])
+            if stage in self.budgets
+            else 0.0
+        )
+        share = self.budgets.get(stage, float("inf"))
+        return max(0.0, min(share, self.remaining() - later))
+
+    @contextmanager
+    def stage(self, name):
+        """Отмечает превышение бюджета этапа; прервать сам этап нельзя."""
+        budget = self.budget(name)
+        start = time.monotonic()
+        try:
+            yield budget
+        finally:
+            elapsed = time.monotonic() - start
+            if elapsed > budget:
+                counter(
+                    "vkbot_deadline_overruns_total",
+                    "Этапы, превысившие свой бюджет времени",
+                    stage=name,
+                ).inc()
+                logger.warning(
+                    f"Этап {name} занял {elapsed:.2f} с при бюджете {budget:.2f} с"
+                )
+
+
+class CircuitBreaker:
+    """Предохранитель для внешнего сервиса.
+
+    После failure_threshold ошибок подряд вызовы не выполняются
+    recovery_time секунд, затем пропускается один пробный вызов: успех
+    замыкает цепь, ошибка снова размыкает её.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=GIGACHAT_BREAKER_FAILURES,
+        recovery_time=GIGACHAT_BREAKER_RECOVERY,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_time = recovery_time
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state != "closed"
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if time.monotonic() - self._opened_at < self.recovery_time:
+                return False
+            # пробный вызов; следующий — не раньше чем через recovery_time
+            self.state = "half_open"
+            self._opened_at = time.monotonic()
+            logger.info(f"Предохранитель {self.name}: пробный запрос")
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Предохранитель {self.name} замкнут")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                counter(
+                    "vkbot_circuit_opened_total",
+                    "Размыкания предохранителя",
+                    upstream=self.name,
+                ).inc()
+                logger.warning(
+                    f"Предохранитель {self.name} разомкнут после "
+                    f"{self.failures} ошибок на {self.recovery_time:.0f} с"
+                )
+
+
+def call_hedged(executor, func, timeout=None, hedge_after=None, hedge_func=None):
+    """Выполняет func в executor и возвращает первый успешный результат.
+
+    Если за hedge_after секунд ответа нет (или первый вызов уже упал),
+    запускается ещё одна копия — hedge_func, если задана. По истечении
+    timeout — TimeoutError, при ошибках обеих копий — исключение последней.
+    Перед выходом незапущенные копии отменяются; уже запущенные функции
+    должны сами проверять, ждут ли их ещё.
+    """
+    start = time.monotonic()
+    pending = {executor.submit(func)}
+    submitted = set(pending)
+    hedge = None
+    error = None
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+            limits = []
+            if timeout is not None:
+                limits.append(timeout - elapsed)
+            if hedge is None and hedge_after is not None:
+                limits.append(hedge_after - elapsed)
+            wait_for = max(0.0, min(limits)) if limits else None
+
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        counter(
+                            "vkbot_hedged_wins_total",
+                            "Ответы, пришедшие от повторного запроса первыми",
+                        ).inc()
+                    return future.result()
+                error = future.exception()
+
+            elapsed = time.monotonic() - start
+            if timeout is not None and elapsed >= timeout:
+                raise TimeoutError(f"нет ответа за {timeout:.2f} с")
+            if hedge is None and hedge_after is not None:
+                if elapsed >= hedge_after or not pending:
+                    counter(
+                        "vkbot_hedged_requests_total", "Повторные (hedged) запросы"
+                    ).inc()
+                    hedge = executor.submit(hedge_func or func)
+                    submitted.add(hedge)
+                    pending.add(hedge)
+                    continue
+            if not pending:
+                raise error
+    finally:
+        # копия, ждущая потока executor, после ухода вызывающего не нужна
+        for future in submitted:
+            future.cancel()
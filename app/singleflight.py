@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from config import USER_RATE_BURST, USER_RATE_PER_MINUTE, USER_REPEAT_WINDOW
+from metrics import counter
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Объединяет одновременные вычисления с одинаковым ключом.
+
+    Первый вызов do() с ключом выполняет функцию, остальные, пришедшие до
+    его завершения, ждут и получают тот же результат (или исключение).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, func):
+        """Возвращает (результат, shared); shared=True у присоединившихся."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            counter(
+                "vkbot_coalesced_total", "Запросы, получившие чужой результат"
+            ).inc()
+            return future.result(), True
+
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result(), False
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.shared
+            return {
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "inflight": len(self._inflight),
+                "shared_ratio": self.shared / total if total else 0.0,
+            }
+
+
+class UserRateLimiter:
+    """Token bucket на каждого пользователя плюс склейка повторов.
+
+    allow() возвращает None, если сообщение нужно обработать, или причину
+    отказа:
+
+    - "merged" — тот же вопрос отправлен, пока предыдущий ещё
+      обрабатывался: ответ на него и так придёт, повтор отбрасывается;
+    - "repeated" — вопрос повторён после ответа, в пределах
+      repeat_window: пользователю коротко напоминают, что ответ выше;
+    - "throttled" — исчерпан лимит пользователя.
+
+    Сообщения одного пользователя обрабатываются по очереди, поэтому
+    «пока обрабатывался» определяется по времени приёма события ботом
+    (received_at, time.monotonic()), а не по моменту обработки. После
+    обработки вызывающий обязан вызвать finish() с путём ответа: повтор
+    вопроса, на который бот не смог ответить, обрабатывается заново.
+    """
+
+    MAX_TRACKED_USERS = 10000
+    # пути, на которых пользователь получил ответ по существу
+    ANSWERED_ROUTES = frozenset(
+        route + suffix
+        for route in ("llm", "cache", "direct", "faq", "list")
+        for suffix in ("", "_shared")
+    )
+
+    def __init__(
+        self,
+        per_minute=USER_RATE_PER_MINUTE,
+        burst=USER_RATE_BURST,
+        repeat_window=USER_REPEAT_WINDOW,
+    ):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.repeat_window = repeat_window
+        self._lock = threading.Lock()
+        self._buckets = {}
+        # user_id -> (ключ вопроса, время доставки ответа или None)
+        self._last = {}
+
+    def _prune(self):
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.idle():
+                del self._buckets[user_id]
+        now = time.monotonic()
+        for user_id, (_, delivered) in list(self._last.items()):
+            if delivered is not None and now - delivered > self.repeat_window:
+                del self._last[user_id]
+
+    def allow(self, user_id, key, received_at=None):
+        """received_at — когда бот принял событие, по умолчанию сейчас."""
+        now = time.monotonic()
+        received_at = now if received_at is None else received_at
+        with self._lock:
+            last = self._last.get(user_id)
+            repeat = last is not None and last[0] == key
+            if repeat and (last[1] is None or received_at < last[1]):
+                reason = "merged"
+            else:
+                if len(self._buckets) > self.MAX_TRACKED_USERS:
+                    self._prune()
+                bucket = self._buckets.get(user_id)
+                if bucket is None:
+                    bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                if not bucket.try_acquire():
+                    reason = "throttled"
+                elif repeat and now - last[1] < self.repeat_window:
+                    reason = "repeated"
+                else:
+                    self._last[user_id] = (key, None)
+                    return None
+        counter(
+            "vkbot_user_rate_limited_total",
+            "Сообщения, отброшенные лимитом пользователя",
+            reason=reason,
+        ).inc()
+        return reason
+
+    def finish(self, user_id, key, route=None):
+        """Отмечает конец обработки вопроса, пропущенного allow().
+
+        route — путь доставленного ответа, None — ответ не доставлен. Если
+        ответа по существу не было (ошибка, запасной ответ, дедлайн), повтор
+        обрабатывается как новый вопрос.
+        """
+        with self._lock:
+            last = self._last.get(user_id)
+            if last is None or last[0] != key or last[1] is not None:
+                return
+            if route in self.ANSWERED_ROUTES:
+                self._last[user_id] = (key, time.monotonic())
+            else:
+                del self._last[user_id]
@@ -1,9 +1,18 @@
 import os
-import torch
-from autocorrect import Speller
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch.nn.functional as F
+import re
+import threading
+import time
+from functools import lru_cache
+
 import logging
+from config import (
+    MODEL_CACHE_DIR,
+    SPELL_CACHE_SIZE,
+    TOXICITY_BATCH_SIZE,
+    TOXICITY_BATCH_WAIT_MS,
+    TOXICITY_QUANTIZE,
+)
+from models import lazy_model
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -11,34 +20,114 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-spell = Speller(lang="ru")
-
 MODEL_NAME = "cointegrated/rubert-tiny-toxicity"
-model_path = "local_model/rubert-tiny-toxicity"
 
-if not os.path.exists(model_path):
-    logger.info("Загрузка модели и токенизатора...")
-    try:
+
+def _load_speller():
+    from autocorrect import Speller
+
+    return Speller(lang="ru")
+
+
+def _load_toxicity_classifier():
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from toxicity import ToxicityClassifier, quantize_dynamic
+
+    model_path = os.path.join(MODEL_CACHE_DIR, "rubert-tiny-toxicity")
+    if not os.path.exists(model_path):
+        logger.info("Загрузка модели и токенизатора...")
         tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
         model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
         tokenizer.save_pretrained(model_path)
         model.save_pretrained(model_path)
         logger.info("Модель и токенизатор успешно сохранены локально.")
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке и сохранении модели: {e}")
-else:
-    logger.info("Модель и токенизатор загружены локально.")
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = model.to(device)
+    model.eval()
+
+    if TOXICITY_QUANTIZE and device.type == "cpu":
+        logger.info("Квантование модели токсичности в int8...")
+        model = quantize_dynamic(model)
+
+    return ToxicityClassifier(
+        tokenizer,
+        model,
+        device,
+        max_batch_size=TOXICITY_BATCH_SIZE,
+        max_wait=TOXICITY_BATCH_WAIT_MS / 1000,
+    )
+
+
+speller = lazy_model("speller", _load_speller)
+toxicity = lazy_model("toxicity", _load_toxicity_classifier)
+
+
+_WORD_RE = re.compile(r"[\w-]+")
+
+protected_vocabulary = frozenset()
+_stats_lock = threading.Lock()
+spelling_stats = {"protected": 0, "known": 0, "speller_calls": 0, "speller_time": 0.0}
+
+
+def set_protected_vocabulary(texts):
+    """Слова из этих текстов (названия проектов и т.п.) не исправляются."""
+    global protected_vocabulary
+    words = set()
+    for text in texts:
+        if text:
+            words.update(w.lower() for w in _WORD_RE.findall(text))
+    protected_vocabulary = frozenset(words)
+    _correct_token.cache_clear()
+    logger.info(f"Защищённый словарь: {len(protected_vocabulary)} слов.")
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        spelling_stats[key] += value
+
+
+@lru_cache(maxsize=SPELL_CACHE_SIZE)
+def _correct_token(word):
+    bare = word.strip('.,!?;:()"«»').lower()
+    if not bare or bare in protected_vocabulary:
+        _count("protected")
+        return word
+    spell = speller.get()
+    if bare in spell.nlp_data:
+        _count("known")
+        return word
+    start = time.perf_counter()
+    corrected = spell(word)
+    _count("speller_time", time.perf_counter() - start)
+    _count("speller_calls")
+    return corrected
+
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = model.to(device)
-model.eval()
+def spelling_cache_stats():
+    info = _correct_token.cache_info()
+    with _stats_lock:
+        stats = dict(spelling_stats)
+    calls = stats["speller_calls"]
+    avg = stats["speller_time"] / calls if calls else 0.0
+    total = info.hits + info.misses
+    stats.update(
+        hits=info.hits,
+        misses=info.misses,
+        size=info.currsize,
+        hit_ratio=info.hits / total if total else 0.0,
+        estimated_time_saved=avg * (info.hits + stats["protected"] + stats["known"]),
+    )
+    return stats
 
 
 def correct_spelling(text):
     logger.debug(f"Коррекция орфографии для текста: {text[:50]}...")
-    corrected_text = " ".join([spell(word) for word in text.split()])
+    corrected_text = " ".join([_correct_token(word) for word in text.split()])
     logger.debug(f"Исправленный текст: {corrected_text[:50]}...")
     return corrected_text
 
@@ -50,13 +139,7 @@ def contains_profanity(text: str, threshold: float = 0.7) -> bool:
     """
     try:
         logger.debug(f"Проверка текста на токсичность: {text[:50]}...")
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True).to(
-            device
-        )
-        with torch.no_grad():
-            outputs = model(**inputs)
-            probs = F.softmax(outputs.logits, dim=1)
-            toxic_score = probs[0][1].item()
+        toxic_score = toxicity.get().score(text)
 
         logger.debug(f"Токсичность текста: {toxic_score:.2f}")
         return toxic_score >= threshold
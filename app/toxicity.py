@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+
+def quantize_dynamic(model):
+    """Динамически квантует Linear-слои модели в int8 (только CPU)."""
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class ToxicityClassifier:
+    """Классификатор токсичности с микро-батчингом.
+
+    Тексты, поступившие из разных потоков в течение max_wait секунд,
+    обрабатываются одним батчем; результат возвращается через Future.
+    """
+
+    def __init__(self, tokenizer, model, device, max_batch_size=16, max_wait=0.005):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def predict_batch(self, texts):
+        inputs = self.tokenizer(
+            texts, return_tensors="pt", truncation=True, padding=True
+        ).to(self.device)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+            probs = F.softmax(outputs.logits, dim=1)
+        return probs[:, 1].tolist()
+
+    def submit(self, text):
+        self._ensure_started()
+        future = Future()
+        self._pending.put((text, future))
+        return future
+
+    def score(self, text):
+        return self.submit(text).result()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._loop, name="toxicity-batcher", daemon=True
+                    )
+                    self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                scores = self.predict_batch(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            logger.debug(f"Батч токсичности: {len(batch)} текстов")
+            for (_, future), score in zip(batch, scores):
+                future.set_result(score)
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+CHUNK_ROWS = 8192
+
+
+def quantize(matrix, dtype):
+    """Переводит нормированную матрицу float32 в dtype.
+
+    Для int8 каждая строка масштабируется отдельно; возвращает (данные,
+    масштабы строк).
+    """
+    if dtype == "int8":
+        peak = np.abs(matrix).max(axis=1, keepdims=True)
+        peak[peak == 0] = 1.0
+        scales = (peak / 127.0).astype(np.float32)
+        data = np.round(matrix / scales).astype(np.int8)
+        return data, scales.ravel()
+    return matrix.astype(DTYPES[dtype]), np.ones(len(matrix), dtype=np.float32)
+
+
+KEEP_VERSIONS = 2
+
+
+def _pointer_path(path):
+    return f"{path}.current"
+
+
+def _versions_dir(path):
+    return f"{path}.versions"
+
+
+def _paths(directory):
+    return (
+        os.path.join(directory, "vectors.npy"),
+        os.path.join(directory, "scales.npy"),
+        os.path.join(directory, "ids.npy"),
+    )
+
+
+def _read_pointer(path):
+    with open(_pointer_path(path), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_store(path, matrix, ids, dtype, version):
+    """Записывает векторы рядом с базой.
+
+    Каждая запись попадает в свой каталог {path}.versions/<имя>, а
+    читателей на неё переключает одна подмена файла-указателя
+    {path}.current, поэтому набор файлов меняется целиком. Старые
+    каталоги, кроме KEEP_VERSIONS последних, удаляются: уже отображённые
+    в память файлы остаются доступны открывшим их процессам.
+    """
+    data, scales = quantize(matrix, dtype)
+    root = _versions_dir(path)
+    os.makedirs(root, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix=f"{time.time_ns():020d}-", dir=root)
+    vectors_path, scales_path, ids_path = _paths(directory)
+    for target, array in (
+        (vectors_path, data),
+        (scales_path, scales),
+        (ids_path, np.asarray(ids, dtype=np.int64)),
+    ):
+        with open(target, "wb") as f:
+            np.save(f, array)
+    pointer = {
+        "dir": os.path.basename(directory),
+        "dtype": dtype,
+        "version": version,
+        "rows": len(ids),
+    }
+    fd, tmp = tempfile.mkstemp(
+        prefix=os.path.basename(_pointer_path(path)) + ".",
+        dir=os.path.dirname(os.path.abspath(path)),
+    )
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(pointer, f)
+    os.replace(tmp, _pointer_path(path))
+    _remove_old_versions(root, keep=pointer["dir"])
+    logger.info(
+        f"Векторное хранилище записано: {len(ids)} векторов, {dtype}, "
+        f"{data.nbytes / 1024:.0f} КБ"
+    )
+
+
+def _remove_old_versions(root, keep):
+    names = sorted(name for name in os.listdir(root) if name != keep)
+    for name in names[: max(0, len(names) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class VectorStore:
+    """Векторы, отображённые в память (mmap) только для чтения.
+
+    Несколько процессов на одном хосте разделяют одни и те же страницы.
+    """
+
+    def __init__(self, path):
+        meta = _read_pointer(path)
+        vectors_path, scales_path, ids_path = _paths(
+            os.path.join(_versions_dir(path), meta["dir"])
+        )
+        self.dtype = meta["dtype"]
+        self.version = meta["version"]
+        self.vectors = np.load(vectors_path, mmap_mode="r")
+        self.scales = np.load(scales_path, mmap_mode="r")
+        self.ids = np.load(ids_path, mmap_mode="r")
+        if not (len(self.vectors) == len(self.scales) == len(self.ids)):
+            raise ValueError("файлы векторного хранилища не согласованы")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, query):
+        """Скалярные произведения с нормированным query, считаются блоками."""
+        query = np.asarray(query, dtype=np.float32)
+        result = np.empty(len(self.vectors), dtype=np.float32)
+        for start in range(0, len(self.vectors), CHUNK_ROWS):
+            block = self.vectors[start : start + CHUNK_ROWS].astype(np.float32)
+            result[start : start + len(block)] = block @ query
+        if self.dtype == "int8":
+            result *= self.scales
+        return result
+
+
+def read_version(path):
+    """Версия хранилища по его указателю, без отображения векторов."""
+    try:
+        return _read_pointer(path)["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def open_store(path):
+    try:
+        return VectorStore(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Не удалось открыть векторное хранилище {path}: {e}")
+        return None